@@ -0,0 +1,78 @@
+from __future__ import division
+
+import config
+from level import Level
+from simulation import Simulation
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+temple_count = 5000
+tick_count = 300
+
+def create_source(path):
+    generator = random.Random(1)
+    source = {
+        'bounds': [[-1000, -10], [1000, 1000]],
+        'sun': [0, 1000],
+        'island': [0, 0],
+        'start': [2, 1.5],
+        'pearly_gates': [10, 990],
+        'temples': [[generator.uniform(-900, 900), generator.uniform(10, 980)]
+                    for _ in range(temple_count)],
+        'clouds': [],
+    }
+    out = open(path, 'w')
+    try:
+        json.dump(source, out)
+    finally:
+        out.close()
+
+def run(results):
+    # Loading a big level the first time compiles it; after that it comes
+    # from the cache.
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'big.json')
+        create_source(path)
+        config.level_cache_dir = None
+        start = time.time()
+        Level.load(path)
+        results.add('level_compile_ms_%d' % temple_count,
+                    (time.time() - start) * 1000, 'ms')
+        start = time.time()
+        level = Level.load(path)
+        results.add('level_load_ms_%d' % temple_count,
+                    (time.time() - start) * 1000, 'ms')
+        # Only the chunks around Icarus get bodies, so stepping a big level
+        # should cost about the same as stepping a small one.
+        config.immortal = True
+        simulation = Simulation(seed=1, level=level)
+        start = time.time()
+        simulation.run(tick_count)
+        duration = time.time() - start
+        results.add('level_ticks_per_second_%d' % temple_count,
+                    tick_count / max(duration, 1e-9), 'ticks/s', higher=True)
+        results.add('level_bodies_%d' % temple_count,
+                    simulation.streamer.body_count(), 'bodies')
+        # The static map covers every temple, streamed in or not. It is
+        # built once per level and read from the level cache after that.
+        cache_dir = level.cache_dir
+        level.cache_dir = None
+        start = time.time()
+        static_map = simulation.create_static_map()
+        results.add('static_map_build_ms_%d' % temple_count,
+                    (time.time() - start) * 1000, 'ms')
+        level.cache_dir = cache_dir
+        start = time.time()
+        simulation.create_static_map()
+        results.add('static_map_load_ms_%d' % temple_count,
+                    (time.time() - start) * 1000, 'ms')
+        results.add('static_map_pairs_%d' % temple_count,
+                    static_map.shade_pair_count, 'pairs')
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,84 @@
+from __future__ import division
+
+from glrecorder import GLRecorder, SpriteRecorder
+
+import os
+import shutil
+import tempfile
+import time
+
+seed = 1
+frame_count = 300
+capture_frame_count = 120
+
+def run(results):
+    # Drives a GameScreen in a hidden window: the vertex lists on_draw uses
+    # need a live GL context.
+    import pyglet
+    try:
+        window = pyglet.window.Window(visible=False)
+    except Exception as error:
+        results.skip('render', 'no window: %s' % error)
+        return
+
+    import config
+    config.seed = seed
+    config.fps = False
+    config.profile = False
+    config.record = None
+    config.replay = None
+    config.capture_dir = tempfile.mkdtemp()
+    config.capture_format = 'raw'
+    config.capture_interval = 1
+    from assets import assets
+    import main
+    main.rabbyt.set_default_attribs()
+    pyglet.resource.path = [os.path.join(os.path.dirname(__file__),
+                                         os.pardir, 'pycarus')]
+    pyglet.resource.reindex()
+    if config.texture_atlas:
+        assets.pack(main.packed_images)
+    screen = main.GameScreen(window, main.SoundEffects())
+    recorder = GLRecorder()
+    screen.flying_sprite = SpriteRecorder(screen.flying_sprite, recorder)
+    screen.walking_sprite = SpriteRecorder(screen.walking_sprite, recorder)
+    screen.icarus.press(main.UP)
+
+    recorder.install()
+    try:
+        draw_time = 0
+        draw_calls = 0
+        dt = screen.simulation.dt
+        for _ in range(frame_count):
+            screen.step(dt)
+            start = time.time()
+            screen.on_draw()
+            draw_time += time.time() - start
+            draw_calls += screen.render_stats.draw_calls
+        recorder.uninstall()
+        # Then record every frame as raw pixels for a while. Deleting the
+        # screen waits for the writer to finish.
+        screen.toggle_frame_recording()
+        for _ in range(capture_frame_count):
+            screen.step(dt)
+            screen.on_draw()
+    finally:
+        recorder.uninstall()
+        screen.delete()
+        window.close()
+        shutil.rmtree(config.capture_dir, True)
+
+    results.add('gl_calls_per_frame', recorder.total() / frame_count, 'calls')
+    for name, count in sorted(recorder.calls.items()):
+        results.add('gl_calls_per_frame_%s' % name, count / frame_count,
+                    'calls')
+    results.add('draw_calls_per_frame', draw_calls / frame_count, 'calls')
+    results.add('on_draw_us', draw_time / frame_count * 1e6, 'us')
+    capture = screen.capture
+    results.add('capture_read_us', capture.read_times.percentile(50) * 1e6,
+                'us')
+    results.add('capture_map_us', capture.map_times.percentile(50) * 1e6,
+                'us')
+    results.add('capture_encode_ms',
+                capture.writer.encode_times.percentile(50) * 1000, 'ms')
+    results.add('capture_dropped', capture.writer.dropped, 'frames')
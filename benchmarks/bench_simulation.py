@@ -0,0 +1,140 @@
+from __future__ import division
+
+import config
+from simulation import Simulation
+from snapshots import snapshot_size
+
+import numpy
+import time
+
+seed = 1
+
+# Fewer ticks for the bigger cloud counts keeps each run to a few seconds.
+tick_counts = {
+    50: 1200,
+    500: 600,
+    5000: 120,
+}
+
+def create_simulation(cloud_count):
+    config.cloud_count = cloud_count
+    config.immortal = True
+    config.profile_frames = None
+    return Simulation(seed=seed)
+
+def bench_ticks(results, cloud_count):
+    # The loop that GameScreen.step_simulation runs once per substep. The
+    # simulation's own profiler splits the time by stage.
+    simulation = create_simulation(cloud_count)
+    ticks = tick_counts[cloud_count]
+    profiler = simulation.profiler
+    start = time.time()
+    for _ in range(ticks):
+        simulation.step()
+        profiler.end_frame()
+    duration = time.time() - start
+    results.add('ticks_per_second_%d' % cloud_count,
+                ticks / max(duration, 1e-9), 'ticks/s', higher=True)
+    for stage in profiler.stages:
+        total = sum(frame.get(stage, 0) for _, frame in profiler.frames)
+        results.add('%s_us_per_tick_%d' % (stage, cloud_count),
+                    total / ticks * 1e6, 'us')
+    results.add('bodies_per_tick_%d' % cloud_count,
+                simulation.simulated_bodies / ticks, 'bodies')
+    # Spawning and expiry both happen in step_clouds.
+    spawn_time = sum(frame.get('spawn', 0) for _, frame in profiler.frames)
+    respawns = simulation.cloud_pool.releases
+    if respawns:
+        results.add('respawn_us_per_cloud_%d' % cloud_count,
+                    spawn_time / respawns * 1e6, 'us')
+
+def bench_raycasts(results, cloud_count, repeat=500, rounds=5):
+    # The best of a few rounds, since single calls are short enough for the
+    # timings to be noisy.
+    simulation = create_simulation(cloud_count)
+    simulation.run(60)
+    simulation.cloud_field.sync_all()
+    icarus = simulation.icarus
+    for name, function in (('update_cloud_distance',
+                            icarus.update_cloud_distance),
+                           ('raycast_cloud_distance',
+                            icarus.raycast_cloud_distance),
+                           ('update_state', icarus.update_state),
+                           ('on_ground', icarus.on_ground),
+                           ('raycast_ground', icarus.raycast_ground)):
+        best = None
+        for _ in range(rounds):
+            start = time.time()
+            for _ in range(repeat):
+                function()
+            duration = time.time() - start
+            if best is None or duration < best:
+                best = duration
+        results.add('%s_us_%d' % (name, cloud_count), best / repeat * 1e6,
+                    'us')
+
+def bench_snapshots(results, cloud_count, repeat=20):
+    # GameScreen takes a snapshot every second for rewinding.
+    simulation = create_simulation(cloud_count)
+    simulation.run(60)
+    start = time.time()
+    for _ in range(repeat):
+        snapshot = simulation.snapshot()
+    results.add('snapshot_us_%d' % cloud_count,
+                (time.time() - start) / repeat * 1e6, 'us')
+    start = time.time()
+    for _ in range(repeat):
+        simulation.restore(snapshot)
+    results.add('restore_us_%d' % cloud_count,
+                (time.time() - start) / repeat * 1e6, 'us')
+    results.add('snapshot_kib_%d' % cloud_count,
+                snapshot_size(snapshot) / 1024, 'KiB')
+
+def bench_shadows(results, cloud_count, ticks=120):
+    # The shadow quads of every cloud, fetched once a tick as the renderer
+    # would with all of them in view. Only the clouds that have moved far
+    # enough get their geometry worked out again.
+    simulation = create_simulation(cloud_count)
+    simulation.run(60)
+    field = simulation.cloud_field
+    updates = field.shadow_updates
+    duration = 0
+    for _ in range(ticks):
+        simulation.step()
+        slots = numpy.arange(len(field))
+        start = time.time()
+        field.shadow_quads(slots, simulation.sun)
+        duration += time.time() - start
+    results.add('shadow_quads_us_%d' % cloud_count, duration / ticks * 1e6,
+                'us')
+    results.add('shadow_updates_per_tick_%d' % cloud_count,
+                (field.shadow_updates - updates) / ticks, 'clouds')
+
+def bench_allocations(results, cloud_count, ticks=600):
+    # Memory left allocated by steady-state ticks; see
+    # headless.py --check-allocations.
+    try:
+        import tracemalloc
+    except ImportError:
+        results.skip('allocations', 'no tracemalloc')
+        return
+    simulation = create_simulation(cloud_count)
+    tracemalloc.start()
+    try:
+        simulation.run(ticks)
+        before = tracemalloc.get_traced_memory()[0]
+        simulation.run(ticks)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results.add('net_bytes_per_tick_%d' % cloud_count,
+                (after - before) / ticks, 'bytes')
+    results.add('peak_traced_kib_%d' % cloud_count, peak / 1024, 'KiB')
+
+def run(results):
+    for cloud_count in sorted(tick_counts):
+        bench_ticks(results, cloud_count)
+        bench_raycasts(results, cloud_count)
+        bench_snapshots(results, cloud_count)
+        bench_shadows(results, cloud_count)
+    bench_allocations(results, 50)
@@ -0,0 +1,66 @@
+from __future__ import division
+
+import sys
+
+class GLRecorder(object):
+    # Counts the GL calls made while it is installed. Every module that has
+    # imported a GL function, with "from pyglet.gl import *" or otherwise,
+    # gets a counting wrapper in its place, so the calls still reach the
+    # driver. Rabbyt draws from C, so its sprites are counted separately with
+    # SpriteRecorder.
+    def __init__(self):
+        self.calls = {}
+        self.patches = []
+
+    def install(self):
+        import pyglet.gl
+        originals = {}
+        for name in dir(pyglet.gl):
+            function = getattr(pyglet.gl, name)
+            if name.startswith('gl') and callable(function):
+                originals[name] = function
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, '__dict__', None)
+            if namespace is None:
+                continue
+            for name, function in originals.items():
+                if namespace.get(name) is function:
+                    namespace[name] = self.wrap(name, function)
+                    self.patches.append((namespace, name, function))
+
+    def uninstall(self):
+        for namespace, name, function in self.patches:
+            namespace[name] = function
+        self.patches = []
+
+    def wrap(self, name, function):
+        calls = self.calls
+        def wrapper(*args):
+            calls[name] = calls.get(name, 0) + 1
+            return function(*args)
+        return wrapper
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset(self):
+        self.calls.clear()
+
+    def total(self):
+        return sum(self.calls.values())
+
+class SpriteRecorder(object):
+    # Stands in for a rabbyt sprite and counts its renders.
+    def __init__(self, sprite, recorder):
+        self.__dict__['sprite'] = sprite
+        self.__dict__['recorder'] = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.sprite, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.sprite, name, value)
+
+    def render(self):
+        self.recorder.count('rabbyt.Sprite.render')
+        self.sprite.render()
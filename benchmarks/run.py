@@ -0,0 +1,121 @@
+from __future__ import division
+
+import os
+import sys
+
+# The game modules import each other by their top-level names.
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(benchmark_dir, os.pardir, 'pycarus'))
+
+import pyglet
+pyglet.options['audio'] = ('silent',)
+
+import bench_level
+import bench_render
+import bench_simulation
+import bench_startup
+import config
+
+import json
+import optparse
+import platform
+import time
+
+class Results(object):
+    def __init__(self):
+        self.results = {}
+        self.skipped = {}
+
+    def add(self, name, value, unit, higher=False):
+        self.results[name] = {'value': value, 'unit': unit,
+                              'better': 'higher' if higher else 'lower'}
+        sys.stdout.write('%-40s %12.2f %s\n' % (name, value, unit))
+
+    def skip(self, suite, reason):
+        self.skipped[suite] = reason
+        sys.stdout.write('skipped %s: %s\n' % (suite, reason))
+
+    def to_json(self):
+        return {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': self.results, 'skipped': self.skipped}
+
+def compare(results, baseline, tolerance):
+    # Returns the names of the results that got worse than the baseline by
+    # more than the tolerance.
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old_value = baseline[name]['value']
+        value = result['value']
+        if not old_value:
+            continue
+        change = (value - old_value) / old_value
+        if result['better'] == 'higher':
+            worse = change < -tolerance
+        else:
+            worse = change > tolerance
+        if worse:
+            regressions.append(name)
+        sys.stdout.write('%-40s %12.2f %12.2f %+7.1f%%%s\n' %
+                         (name, old_value, value, change * 100,
+                          ' REGRESSION' if worse else ''))
+    return regressions
+
+def parse_args(args):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--output', metavar='FILE',
+                      default='benchmark-results.json',
+                      help='write the results to a JSON file')
+    parser.add_option('--baseline', metavar='FILE',
+                      default=os.path.join(benchmark_dir, 'baseline.json'),
+                      help='compare the results against a JSON file')
+    parser.add_option('--save-baseline', action='store_true',
+                      help='store the results as the new baseline')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='relative change allowed before a regression')
+    parser.add_option('--no-render', action='store_true',
+                      help='skip the benchmarks that need a window')
+    return parser.parse_args(args)
+
+def main(args=None):
+    options, _ = parse_args(sys.argv[1:] if args is None else args)
+    suites = [bench_level, bench_simulation]
+    if not options.no_render:
+        suites += [bench_startup, bench_render]
+    defaults = dict((name, value) for name, value in vars(config).items()
+                    if not name.startswith('_'))
+    results = Results()
+    for suite in suites:
+        suite.run(results)
+        for name, value in defaults.items():
+            setattr(config, name, value)
+    data = results.to_json()
+    out = open(options.output, 'w')
+    try:
+        json.dump(data, out, indent=2, sort_keys=True)
+    finally:
+        out.close()
+    if options.save_baseline:
+        out = open(options.baseline, 'w')
+        try:
+            json.dump(data, out, indent=2, sort_keys=True)
+        finally:
+            out.close()
+        return 0
+    if not os.path.exists(options.baseline):
+        sys.stdout.write('no baseline at %s\n' % options.baseline)
+        return 0
+    baseline = json.load(open(options.baseline))['results']
+    sys.stdout.write('\n%-40s %12s %12s %8s\n' %
+                     ('benchmark', 'baseline', 'current', 'change'))
+    regressions = compare(data['results'], baseline, options.tolerance)
+    if regressions:
+        sys.stdout.write('%d regressions\n' % len(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
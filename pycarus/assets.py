@@ -0,0 +1,161 @@
+from __future__ import division
+
+from io import BytesIO
+import pyglet
+import pyglet.image.atlas
+import pyglet.media
+import threading
+import time
+
+class Assets(object):
+    # Loads each image and sound once and shares it. Assets can be preloaded:
+    # a worker thread reads the files and the main thread decodes one asset
+    # per frame, so nothing stalls on disk when it is first used. Textures
+    # named with pack() go into a shared texture atlas. Long sounds can be
+    # streamed from disk instead of being decoded up front. The lock guards
+    # pending and data, which the worker thread writes to.
+    def __init__(self):
+        self.textures = {}
+        self.sounds = {}
+        self.stats = {}
+        self.packed = set()
+        self.texture_bin = None
+        self.data = {}
+        self.read_times = {}
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def pack(self, names):
+        self.packed.update(names)
+
+    def texture(self, name):
+        texture = self.textures.get(name)
+        if texture is None:
+            start = time.time()
+            image = pyglet.image.load(name, file=BytesIO(self.read(name)))
+            if name in self.packed:
+                if self.texture_bin is None:
+                    self.texture_bin = pyglet.image.atlas.TextureBin(1024,
+                                                                     1024)
+                texture = self.texture_bin.add(image)
+            else:
+                texture = image.get_texture()
+            self.textures[name] = texture
+            self.add_stats(name, 'texture', time.time() - start,
+                           texture.width * texture.height * 4)
+        return texture
+
+    def sound(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            start = time.time()
+            # AVbin only opens files by name, so the sound is decoded from
+            # its path, and preloading it only warms the disk cache.
+            self.take(name)
+            sound = pyglet.resource.media(name, streaming=False)
+            self.sounds[name] = sound
+            audio_format = sound.audio_format
+            size = (sound.duration * audio_format.sample_rate *
+                    audio_format.channels * audio_format.sample_size // 8)
+            self.add_stats(name, 'sound', time.time() - start, int(size))
+        return sound
+
+    def stream(self, name):
+        # A new source every time, since a streaming source can only be
+        # queued on one player.
+        start = time.time()
+        source = pyglet.resource.media(name, streaming=True)
+        self.add_stats(name, 'stream', time.time() - start, 0)
+        return source
+
+    def clear(self):
+        self.textures.clear()
+        self.sounds.clear()
+        self.stats.clear()
+        self.texture_bin = None
+        with self.lock:
+            del self.pending[:]
+            self.data.clear()
+
+    def load(self, name):
+        if name.endswith('.wav'):
+            return self.sound(name)
+        else:
+            return self.texture(name)
+
+    def read(self, name):
+        # Take the file contents from the preload thread if it got there
+        # first, otherwise read them now.
+        data = self.take(name)
+        if data is None:
+            start = time.time()
+            data = self.read_file(pyglet.resource.file(name))
+            self.read_times[name] = time.time() - start
+        return data
+
+    def take(self, name):
+        # Stop waiting for a preloaded file and return its contents, or None
+        # if the worker thread has not read it yet.
+        with self.lock:
+            if name in self.pending:
+                self.pending.remove(name)
+            return self.data.pop(name, None)
+
+    def read_file(self, file):
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+    def add_stats(self, name, kind, seconds, size):
+        seconds += self.read_times.pop(name, 0)
+        self.stats[name] = kind, seconds, size
+
+    def preload(self, names):
+        with self.lock:
+            names = [name for name in names
+                     if name not in self.textures and
+                     name not in self.sounds and name not in self.pending]
+            if not names:
+                return
+            self.pending.extend(names)
+        # Files are opened here since pyglet.resource is not thread safe.
+        files = [(name, pyglet.resource.file(name)) for name in names]
+        thread = threading.Thread(target=self.read_files, args=(files,))
+        thread.daemon = True
+        thread.start()
+        pyglet.clock.schedule(self.update)
+
+    def read_files(self, files):
+        for name, file in files:
+            start = time.time()
+            data = self.read_file(file)
+            with self.lock:
+                if name in self.pending:
+                    self.read_times[name] = time.time() - start
+                    self.data[name] = data
+
+    def update(self, dt):
+        with self.lock:
+            ready = [name for name in self.pending if name in self.data]
+        if ready:
+            self.load(ready[0])
+        with self.lock:
+            done = not self.pending
+        if done:
+            pyglet.clock.unschedule(self.update)
+
+    def report(self):
+        lines = []
+        total_seconds = 0
+        total_size = 0
+        for name, (kind, seconds, size) in sorted(self.stats.items()):
+            lines.append('%-28s %-8s %8.1f ms %10.1f KiB' %
+                         (name, kind, seconds * 1000, size / 1024))
+            total_seconds += seconds
+            total_size += size
+        lines.append('%-28s %-8s %8.1f ms %10.1f KiB' %
+                     ('total', '', total_seconds * 1000, total_size / 1024))
+        return '\n'.join(lines)
+
+assets = Assets()
@@ -0,0 +1,176 @@
+from __future__ import division
+
+import config
+from level import Level
+from replay import Script
+from simulation import Simulation, UP, LEFT, RIGHT
+
+import ast
+import csv
+import itertools
+import multiprocessing
+import optparse
+import random
+import sys
+import time
+
+columns = ['run', 'seed', 'script', 'overrides', 'outcome', 'ticks',
+           'seconds', 'peak_damage', 'peak_fatigue', 'peak_height',
+           'wall_seconds']
+
+defaults = dict((name, value) for name, value in vars(config).items()
+                if not name.startswith('_'))
+scripts = {}
+levels = {}
+
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def parse_override(text):
+    name, _, value = text.partition('=')
+    if name not in defaults:
+        raise ValueError('unknown config value: %s' % name)
+    return name, value
+
+def random_script(seed, ticks):
+    # Random input for runs without a script: hold a random set of controls
+    # for a random while, with a bias towards flying.
+    generator = random.Random(seed)
+    choices = [set([UP]), set([UP]), set([UP, LEFT]), set([UP, RIGHT]),
+               set([LEFT]), set([RIGHT]), set()]
+    changes = []
+    tick = 0
+    while tick < ticks:
+        changes.append((tick, generator.choice(choices)))
+        tick += generator.randint(15, 120)
+    return Script(changes)
+
+def load_script(path, seed, ticks):
+    if path is None:
+        return random_script(seed, ticks)
+    if path not in scripts:
+        scripts[path] = Script.load(path)
+    return scripts[path]
+
+def run_job(job):
+    # Runs in a worker process, which may have run other jobs before, so
+    # config starts from its defaults every time.
+    index, seed, script_path, overrides, ticks = job
+    for name, value in defaults.items():
+        setattr(config, name, value)
+    for name, value in overrides:
+        setattr(config, name, parse_value(value))
+    start = time.time()
+    if config.level not in levels:
+        levels[config.level] = Level.load(config.level)
+    simulation = Simulation(seed=seed, level=levels[config.level])
+    simulation.script = load_script(script_path, seed, ticks)
+    icarus = simulation.icarus
+    peak_damage = 0
+    peak_fatigue = 0
+    peak_height = 0
+    outcome = 'timeout'
+    for _ in range(ticks):
+        simulation.step()
+        peak_damage = max(peak_damage, icarus.damage)
+        peak_fatigue = max(peak_fatigue, icarus.fatigue)
+        peak_height = max(peak_height, icarus.body.position.y)
+        if simulation.won():
+            outcome = 'won'
+            break
+        if simulation.lost():
+            outcome = 'fell'
+            break
+    return {
+        'run': index,
+        'seed': seed,
+        'script': script_path or 'random',
+        'overrides': ' '.join('%s=%s' % override for override in overrides),
+        'outcome': outcome,
+        'ticks': simulation.ticks,
+        'seconds': '%.2f' % simulation.time,
+        'peak_damage': '%.3f' % peak_damage,
+        'peak_fatigue': '%.3f' % peak_fatigue,
+        'peak_height': '%.2f' % peak_height,
+        'wall_seconds': '%.3f' % (time.time() - start),
+    }
+
+def create_jobs(options):
+    # One job per seed, script and combination of swept values.
+    overrides = [parse_override(text) for text in options.set]
+    sweeps = []
+    for text in options.sweep:
+        name, values = parse_override(text)
+        sweeps.append([(name, value) for value in values.split(',')])
+    script_paths = options.script or [None]
+    jobs = []
+    for combination in itertools.product(*sweeps):
+        for script_path in script_paths:
+            for seed in range(options.seed, options.seed + options.runs):
+                jobs.append((len(jobs), seed, script_path,
+                             overrides + list(combination), options.ticks))
+    return jobs
+
+def parse_args(args):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=100,
+                      help='number of seeds to run')
+    parser.add_option('--seed', type='int', default=1,
+                      help='first seed')
+    parser.add_option('--ticks', type='int', default=36000,
+                      help='give up on a run after this many ticks')
+    parser.add_option('--script', action='append', default=[],
+                      help='scripted input file; can be given more than once '
+                      '(random input if not given)')
+    parser.add_option('--set', action='append', default=[],
+                      metavar='NAME=VALUE', help='override a config value')
+    parser.add_option('--sweep', action='append', default=[],
+                      metavar='NAME=A,B,...',
+                      help='run every job with each of the config values')
+    parser.add_option('--processes', type='int',
+                      help='worker processes (one per core by default)')
+    parser.add_option('--output', metavar='FILE',
+                      help='write the results table to a CSV file')
+    return parser.parse_args(args)
+
+def main(args=None):
+    options, _ = parse_args(sys.argv[1:] if args is None else args)
+    jobs = create_jobs(options)
+    processes = options.processes or multiprocessing.cpu_count()
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Small chunks keep the workers evenly loaded, since runs that fall
+        # early are much shorter than the others.
+        chunk_size = max(1, len(jobs) // (processes * 8))
+        results = list(pool.imap_unordered(run_job, jobs, chunk_size))
+    finally:
+        pool.close()
+        pool.join()
+    duration = time.time() - start
+    results.sort(key=lambda result: result['run'])
+    out = open(options.output, 'w') if options.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out, columns, lineterminator='\n')
+        writer.writerow(dict((column, column) for column in columns))
+        writer.writerows(results)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    ticks = sum(result['ticks'] for result in results)
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+    sys.stderr.write('%d runs in %.1f s with %d processes: %s\n' %
+                     (len(results), duration, processes,
+                      ', '.join('%s %d' % item
+                                for item in sorted(outcomes.items()))))
+    sys.stderr.write('%.1f runs per second, %.0f ticks per second\n' %
+                     (len(results) / max(duration, 1e-9),
+                      ticks / max(duration, 1e-9)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+from __future__ import division
+
+from profiler import LatencyMeter, timer
+
+from collections import deque
+import ctypes
+import pyglet
+from pyglet.gl import *
+from pyglet.gl import gl_info
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class FrameWriter(object):
+    # Writes captured frames to disk on a worker thread. Frames come as RGBA
+    # bytes, bottom row first. When the queue is full the frame is dropped
+    # rather than have the main thread wait for the disk.
+    def __init__(self, queue_size=8):
+        self.frames = queue.Queue(queue_size)
+        self.encode_times = LatencyMeter()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, path, format, width, height, data):
+        try:
+            self.frames.put_nowait((path, format, width, height, data))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            start = timer()
+            try:
+                write_frame(*frame)
+            except EnvironmentError:
+                self.failed += 1
+                continue
+            self.encode_times.add(timer() - start)
+            self.written += 1
+
+    def close(self):
+        # Waits for the frames already queued to be written.
+        self.frames.put(None)
+        self.thread.join()
+
+def write_frame(path, format, width, height, data):
+    # Raw frames are the pixels as read, for converting after the game.
+    if format == 'raw':
+        out = open(path, 'wb')
+        try:
+            out.write(data)
+        finally:
+            out.close()
+    else:
+        image = pyglet.image.ImageData(width, height, 'RGBA', data)
+        image.format = 'RGB'
+        image.save(path)
+
+class FrameCapture(object):
+    # Reads frames back from the color buffer and hands them to a
+    # FrameWriter. With pixel buffer objects, glReadPixels goes into the
+    # next of a ring of buffers and returns without waiting for the
+    # transfer. The buffer is mapped on a later frame, when the transfer has
+    # had a frame to finish, or sooner if the ring runs out. Without them
+    # the read blocks, but the encoding still happens off the main thread.
+    def __init__(self, window, buffer_count=3, queue_size=8):
+        self.window = window
+        self.buffer_count = buffer_count
+        self.writer = FrameWriter(queue_size)
+        self.use_buffers = gl_info.have_extension(
+            'GL_ARB_pixel_buffer_object')
+        self.buffers = None
+        self.size = None
+        self.next_buffer = 0
+        self.pending = deque()
+        self.frame_number = 0
+        self.captured = 0
+        self.read_times = LatencyMeter()
+        self.map_times = LatencyMeter()
+
+    def delete(self):
+        self.flush()
+        self.delete_buffers()
+        self.writer.close()
+
+    def create_buffers(self, width, height):
+        self.buffers = (GLuint * self.buffer_count)()
+        glGenBuffersARB(self.buffer_count, self.buffers)
+        for buffer in self.buffers:
+            glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, buffer)
+            glBufferDataARB(GL_PIXEL_PACK_BUFFER_ARB, width * height * 4, None,
+                            GL_STREAM_READ_ARB)
+        glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, 0)
+        self.size = width, height
+        self.next_buffer = 0
+
+    def delete_buffers(self):
+        if self.buffers is not None:
+            glDeleteBuffersARB(self.buffer_count, self.buffers)
+            self.buffers = None
+            self.size = None
+
+    def update(self):
+        # Call once a frame, after drawing. Hands over the reads started on
+        # earlier frames.
+        self.frame_number += 1
+        while self.pending and self.pending[0][0] < self.frame_number:
+            self.map_oldest()
+
+    def capture(self, path, format='png'):
+        # Read back the frame just drawn, before the flip. The format is
+        # 'png' or 'raw'.
+        start = timer()
+        width, height = self.window.width, self.window.height
+        if self.use_buffers:
+            if self.size != (width, height):
+                self.flush()
+                self.delete_buffers()
+                self.create_buffers(width, height)
+            if len(self.pending) == self.buffer_count:
+                self.map_oldest()
+            buffer = self.buffers[self.next_buffer]
+            self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+            glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, buffer)
+            glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, None)
+            glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, 0)
+            self.pending.append((self.frame_number, buffer, path, format,
+                                 width, height))
+        else:
+            size = width * height * 4
+            data = (GLubyte * size)()
+            glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, data)
+            self.writer.put(path, format, width, height,
+                            ctypes.string_at(data, size))
+        self.captured += 1
+        self.read_times.add(timer() - start)
+
+    def map_oldest(self):
+        _, buffer, path, format, width, height = self.pending.popleft()
+        start = timer()
+        glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, buffer)
+        pointer = glMapBufferARB(GL_PIXEL_PACK_BUFFER_ARB, GL_READ_ONLY_ARB)
+        if pointer:
+            data = ctypes.string_at(pointer, width * height * 4)
+            glUnmapBufferARB(GL_PIXEL_PACK_BUFFER_ARB)
+            self.writer.put(path, format, width, height, data)
+        glBindBufferARB(GL_PIXEL_PACK_BUFFER_ARB, 0)
+        self.map_times.add(timer() - start)
+
+    def flush(self):
+        while self.pending:
+            self.map_oldest()
+
+    def report(self):
+        writer = self.writer
+        return ('capture: %d frames, %d written, %d dropped, read %.2f ms, '
+                'map %.2f ms, encode %.1f ms' %
+                (self.captured, writer.written, writer.dropped,
+                 self.read_times.percentile(50) * 1000,
+                 self.map_times.percentile(50) * 1000,
+                 writer.encode_times.percentile(50) * 1000))
@@ -0,0 +1,186 @@
+from __future__ import division
+
+import b2
+import config
+
+import numpy
+
+class CloudField(object):
+    # Positions and drift speeds of all clouds, in arrays that are advanced
+    # with a few vector operations per tick. Cloud bodies are static sensors
+    # that only raycasts look at, so only the bodies of drifting clouds near
+    # Icarus are moved into place. The rest wait below the sea.
+    #
+    # The field also caches the shadow of each cloud, as the corners of its
+    # quad relative to the cloud. See shadow_quads.
+    def __init__(self):
+        self.clouds = []
+        self.capacity = 0
+        self.positions = numpy.zeros((0, 2))
+        self.dxs = numpy.zeros(0)
+        self.synced = numpy.zeros(0, dtype=bool)
+        self.half_widths = numpy.zeros(0)
+        self.shadow_offsets = numpy.zeros((0, 8))
+        self.shadow_anchors = numpy.zeros((0, 2))
+        self.shadow_tolerances = numpy.zeros(0)
+        self.shadow_revisions = numpy.zeros(0, dtype=int)
+        self.shadow_updates = 0
+        self.max_half_width = 0
+        self.sync_count = 0
+        # Reused for every body moved, which copies it.
+        self.sync_position = b2.b2Vec2(0, 0)
+
+    def __len__(self):
+        return len(self.clouds)
+
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        capacity = max(count, 2 * self.capacity, 16)
+        size = len(self.clouds)
+        positions = numpy.zeros((capacity, 2))
+        positions[:size] = self.positions[:size]
+        dxs = numpy.zeros(capacity)
+        dxs[:size] = self.dxs[:size]
+        synced = numpy.zeros(capacity, dtype=bool)
+        synced[:size] = self.synced[:size]
+        half_widths = numpy.zeros(capacity)
+        half_widths[:size] = self.half_widths[:size]
+        shadow_offsets = numpy.zeros((capacity, 8))
+        shadow_offsets[:size] = self.shadow_offsets[:size]
+        shadow_anchors = numpy.zeros((capacity, 2))
+        shadow_anchors[:size] = self.shadow_anchors[:size]
+        shadow_tolerances = numpy.zeros(capacity)
+        shadow_tolerances[:size] = self.shadow_tolerances[:size]
+        shadow_revisions = numpy.zeros(capacity, dtype=int)
+        shadow_revisions[:size] = self.shadow_revisions[:size]
+        self.positions = positions
+        self.dxs = dxs
+        self.synced = synced
+        self.half_widths = half_widths
+        self.shadow_offsets = shadow_offsets
+        self.shadow_anchors = shadow_anchors
+        self.shadow_tolerances = shadow_tolerances
+        self.shadow_revisions = shadow_revisions
+        self.capacity = capacity
+
+    def add(self, cloud, position):
+        # The body of a drifting cloud starts out where the cloud is and is
+        # parked on the next step unless Icarus is close.
+        self.reserve(len(self.clouds) + 1)
+        slot = len(self.clouds)
+        cloud.field_slot = slot
+        self.clouds.append(cloud)
+        self.positions[slot] = position
+        self.dxs[slot] = cloud.dx
+        self.synced[slot] = bool(cloud.dx)
+        self.half_widths[slot] = cloud.width / 2
+        # No sun revision is negative, so the shadow is worked out when it
+        # is first asked for.
+        self.shadow_revisions[slot] = -1
+        self.max_half_width = max(self.max_half_width, cloud.width / 2)
+
+    def remove(self, cloud):
+        slot = cloud.field_slot
+        last_slot = len(self.clouds) - 1
+        last = self.clouds.pop()
+        if last is not cloud:
+            self.clouds[slot] = last
+            last.field_slot = slot
+            self.positions[slot] = self.positions[last_slot]
+            self.dxs[slot] = self.dxs[last_slot]
+            self.synced[slot] = self.synced[last_slot]
+            self.half_widths[slot] = self.half_widths[last_slot]
+            self.shadow_offsets[slot] = self.shadow_offsets[last_slot]
+            self.shadow_anchors[slot] = self.shadow_anchors[last_slot]
+            self.shadow_tolerances[slot] = self.shadow_tolerances[last_slot]
+            self.shadow_revisions[slot] = self.shadow_revisions[last_slot]
+        self.synced[last_slot] = False
+
+    def position(self, cloud):
+        x, y = self.positions[cloud.field_slot]
+        return float(x), float(y)
+
+    def step(self, dt, focus):
+        size = len(self.clouds)
+        positions = self.positions[:size]
+        dxs = self.dxs[:size]
+        positions[:, 0] += dxs * dt
+        # Bodies near the focus follow their clouds. Bodies that have just
+        # left the neighbourhood are parked so that stale bodies do not get
+        # in the way of raycasts.
+        focus_x, focus_y = focus
+        margin = config.cloud_sync_margin
+        near = ((numpy.abs(positions[:, 0] - focus_x) <=
+                 self.max_half_width + margin) &
+                (numpy.abs(positions[:, 1] - focus_y) <=
+                 config.cloud_height / 2 + margin) & (dxs != 0))
+        synced = self.synced[:size]
+        for slot in numpy.flatnonzero(near):
+            self.sync(slot)
+        for slot in numpy.flatnonzero(synced & ~near):
+            self.clouds[slot].park()
+        self.synced[:size] = near
+
+    def sync(self, slot):
+        x, y = self.positions[slot]
+        position = self.sync_position
+        position.x = float(x)
+        position.y = float(y)
+        self.clouds[slot].body.SetXForm(position, 0)
+        self.sync_count += 1
+
+    def sync_all(self):
+        # Move every drifting body into place, for raycasts against the
+        # whole world.
+        size = len(self.clouds)
+        drifting = self.dxs[:size] != 0
+        for slot in numpy.flatnonzero(drifting):
+            self.sync(slot)
+        self.synced[:size] |= drifting
+
+    def shadow_quads(self, slots, sun, positions=None):
+        # Shadow quads for the clouds in the given slots, as an (n, 8) array
+        # holding the top left, top right, bottom right and bottom left
+        # corners. The bottom corners are the top corners pushed away from
+        # the sun's shadow position. The corners are cached relative to each
+        # cloud and worked out again only for a new sun revision or a cloud
+        # that has moved far enough to turn its shadow by more than
+        # shadow_error at the far end; until then a shadow just moves along
+        # with its cloud, so the shadows of static clouds cost an addition.
+        # The renderer passes interpolated positions.
+        if positions is None:
+            positions = self.positions[slots]
+        moved = numpy.abs(positions - self.shadow_anchors[slots]).max(axis=1)
+        stale = ((self.shadow_revisions[slots] != sun.shadow_revision) |
+                 (moved > self.shadow_tolerances[slots]))
+        if stale.any():
+            self.update_shadows(slots[stale], positions[stale], sun)
+        quads = self.shadow_offsets[slots]
+        quads[:, 0::2] += positions[:, 0:1]
+        quads[:, 1::2] += positions[:, 1:2]
+        return quads
+
+    def update_shadows(self, slots, positions, sun):
+        sun_position = numpy.asarray(sun.shadow_position, dtype=numpy.float64)
+        half_widths = self.half_widths[slots]
+        offsets = numpy.zeros((len(slots), 8))
+        offsets[:, 0] = -half_widths
+        offsets[:, 2] = half_widths
+        for top, bottom in ((0, 6), (2, 4)):
+            corner = offsets[:, top:top + 2]
+            slope = positions + corner - sun_position
+            slope /= numpy.maximum(numpy.hypot(slope[:, 0], slope[:, 1]),
+                                   1e-9)[:, None]
+            offsets[:, bottom:bottom + 2] = (corner +
+                                             slope * config.shadow_length)
+        self.shadow_offsets[slots] = offsets
+        self.shadow_anchors[slots] = positions
+        # Moving a cloud by d turns its shadow by about d over its distance
+        # to the sun.
+        distances = numpy.hypot(positions[:, 0] - sun_position[0],
+                                positions[:, 1] - sun_position[1])
+        self.shadow_tolerances[slots] = (config.shadow_error * distances /
+                                         config.shadow_length)
+        self.shadow_revisions[slots] = sun.shadow_revision
+        self.shadow_updates += len(slots)
@@ -0,0 +1,250 @@
+from __future__ import division
+
+import config
+
+import heapq
+from math import *
+
+class CloudIndex(object):
+    # Uniform grid over the clouds, bucketed by the cell holding each cloud's
+    # center. Drifting clouds keep a constant horizontal speed, so rather than
+    # rebucketing every cloud every tick the index works out the tick at which
+    # each one will cross into the next cell or past the expiry line, and
+    # only looks at those clouds when their tick comes up. Positions come
+    # from the cloud field rather than the bodies.
+    def __init__(self, field, cell_size, max_x, max_dx, dt):
+        self.field = field
+        self.cell_size = cell_size
+        self.max_x = max_x
+        self.max_dx = max_dx
+        self.dt = dt
+        self.clouds = []
+        self.drifting_count = 0
+        self.cells = {}
+        self.events = []
+        self.event_count = 0
+        self.tick = 0
+        self.margin_x = 0
+        self.margin_y = config.cloud_height / 2
+
+    def __len__(self):
+        return len(self.clouds)
+
+    def __iter__(self):
+        return iter(self.clouds)
+
+    def cell(self, x, y):
+        return (int(floor(x / self.cell_size)),
+                int(floor(y / self.cell_size)))
+
+    def add(self, cloud, cell=None, schedule=True, position=None):
+        # A restored cloud comes with its position and the cell it was
+        # bucketed in, and its event is pushed separately. The position is
+        # taken as given, since the body only holds it in single precision.
+        cloud.slot = len(self.clouds)
+        self.clouds.append(cloud)
+        self.margin_x = max(self.margin_x, cloud.width / 2)
+        if position is None:
+            position = cloud.body.position.tuple()
+        self.field.add(cloud, position)
+        x, y = self.field.position(cloud)
+        cloud.cell = self.cell(x, y) if cell is None else cell
+        self.cells.setdefault(cloud.cell, []).append(cloud)
+        cloud.event = None
+        if cloud.dx:
+            self.drifting_count += 1
+            if schedule:
+                self.schedule(cloud, x)
+
+    def remove(self, cloud):
+        last = self.clouds.pop()
+        if last is not cloud:
+            self.clouds[cloud.slot] = last
+            last.slot = cloud.slot
+        bucket = self.cells[cloud.cell]
+        bucket.remove(cloud)
+        if not bucket:
+            del self.cells[cloud.cell]
+        cloud.event = None
+        if cloud.dx:
+            self.drifting_count -= 1
+        self.field.remove(cloud)
+
+    def schedule(self, cloud, x):
+        # Find the distance to the next cell boundary or to the expiry line,
+        # whichever comes first in the direction of travel.
+        if cloud.dx > 0:
+            boundary = (floor(x / self.cell_size) + 1) * self.cell_size
+            if x <= self.max_x:
+                boundary = min(boundary, self.max_x)
+        else:
+            boundary = floor(x / self.cell_size) * self.cell_size
+            if x >= -self.max_x:
+                boundary = max(boundary, -self.max_x)
+        distance = abs(boundary - x)
+        ticks = max(1, int(ceil(distance / abs(cloud.dx * self.dt))))
+        self.push_event(cloud, self.tick + ticks)
+
+    def push_event(self, cloud, tick):
+        self.event_count += 1
+        cloud.event = self.event_count
+        heapq.heappush(self.events, (tick, self.event_count, cloud))
+
+    def update(self, tick):
+        # Rebucket the clouds that are due and return the ones that have
+        # drifted past the expiry line.
+        self.tick = tick
+        expired = []
+        while self.events and self.events[0][0] <= tick:
+            _, event, cloud = heapq.heappop(self.events)
+            if cloud.event != event:
+                continue
+            x, y = self.field.position(cloud)
+            if abs(x) > self.max_x:
+                cloud.event = None
+                expired.append(cloud)
+                continue
+            cell = self.cell(x, y)
+            if cell != cloud.cell:
+                bucket = self.cells[cloud.cell]
+                bucket.remove(cloud)
+                if not bucket:
+                    del self.cells[cloud.cell]
+                cloud.cell = cell
+                self.cells.setdefault(cell, []).append(cloud)
+            self.schedule(cloud, x)
+        return expired
+
+    def snapshot(self):
+        # The drifting clouds in index order as (x, y, dx, cell, event tick,
+        # event), and the tick of the last update.
+        ticks = dict((event, tick) for tick, event, _ in self.events)
+        positions = self.field.positions
+        clouds = []
+        for cloud in self.clouds:
+            if cloud.dx:
+                x, y = positions[cloud.field_slot]
+                clouds.append((float(x), float(y), cloud.dx, cloud.cell,
+                               ticks[cloud.event], cloud.event))
+        return self.tick, clouds
+
+    def remove_drifting(self):
+        clouds = [cloud for cloud in self.clouds if cloud.dx]
+        for cloud in clouds:
+            self.remove(cloud)
+        return clouds
+
+    def restore(self, snapshot, clouds):
+        # Add the clouds, fresh from the pool at the snapshot's positions,
+        # with their cells and events as they were. Events get new numbers,
+        # handed out in the old order so that events due on the same tick
+        # still come up in the same order. Stale events are dropped on the
+        # way.
+        self.tick, states = snapshot
+        self.events = [event for event in self.events
+                       if event[2].event == event[1]]
+        heapq.heapify(self.events)
+        for cloud, state in zip(clouds, states):
+            self.add(cloud, state[3], schedule=False,
+                     position=(state[0], state[1]))
+        for cloud, state in sorted(zip(clouds, states),
+                                   key=lambda pair: pair[1][5]):
+            self.push_event(cloud, state[4])
+
+    def query(self, lower, upper):
+        # Clouds whose boxes overlap the rectangle from lower to upper. Cells
+        # are widened by the cloud extents plus a little slack for clouds
+        # that have moved since the last update.
+        slack = self.max_dx * self.dt
+        margin_x = self.margin_x + slack
+        margin_y = self.margin_y + slack
+        min_x, min_y = lower
+        max_x, max_y = upper
+        min_i, min_j = self.cell(min_x - margin_x, min_y - margin_y)
+        max_i, max_j = self.cell(max_x + margin_x, max_y + margin_y)
+        positions = self.field.positions
+        clouds = []
+        for j in range(min_j, max_j + 1):
+            for i in range(min_i, max_i + 1):
+                bucket = self.cells.get((i, j))
+                if bucket is None:
+                    continue
+                for cloud in bucket:
+                    x, y = positions[cloud.field_slot]
+                    half_width = cloud.width / 2
+                    if (x + half_width >= min_x and x - half_width <= max_x and
+                        y + self.margin_y >= min_y and
+                        y - self.margin_y <= max_y):
+                        clouds.append(cloud)
+        return clouds
+
+    def raycast(self, p1, p2, static=True):
+        # Analytic counterpart of world.RaycastOne restricted to clouds. Walk
+        # the grid rows that the segment crosses, test the boxes in the cells
+        # it passes through and return the nearest hit as (fraction, cloud).
+        # Pass static=False to leave out the static clouds.
+        x1, y1 = p1
+        x2, y2 = p2
+        dx = x2 - x1
+        dy = y2 - y1
+        slack = self.max_dx * self.dt
+        margin_x = self.margin_x + slack
+        margin_y = self.margin_y + slack
+        min_j = self.cell(0, min(y1, y2) - margin_y)[1]
+        max_j = self.cell(0, max(y1, y2) + margin_y)[1]
+        positions = self.field.positions
+        hit_fraction = 1
+        hit_cloud = None
+        for j in range(min_j, max_j + 1):
+            # The part of the segment that can touch clouds centered in this
+            # row.
+            if dy:
+                t1 = (j * self.cell_size - margin_y - y1) / dy
+                t2 = ((j + 1) * self.cell_size + margin_y - y1) / dy
+                t1, t2 = max(0, min(t1, t2)), min(1, max(t1, t2))
+                if t1 > t2:
+                    continue
+            else:
+                t1, t2 = 0, 1
+            row_x1 = x1 + dx * t1
+            row_x2 = x1 + dx * t2
+            min_i = self.cell(min(row_x1, row_x2) - margin_x, 0)[0]
+            max_i = self.cell(max(row_x1, row_x2) + margin_x, 0)[0]
+            for i in range(min_i, max_i + 1):
+                bucket = self.cells.get((i, j))
+                if bucket is None:
+                    continue
+                for cloud in bucket:
+                    if not static and not cloud.dx:
+                        continue
+                    x, y = positions[cloud.field_slot]
+                    fraction = segment_box_fraction(
+                        x1, y1, dx, dy, x, y, cloud.width / 2, self.margin_y)
+                    if fraction is not None and fraction < hit_fraction:
+                        hit_fraction = fraction
+                        hit_cloud = cloud
+        return hit_fraction, hit_cloud
+
+def segment_box_fraction(x, y, dx, dy, center_x, center_y, half_width,
+                         half_height):
+    # Slab test against an axis-aligned box. Like Box2D's polygon segment
+    # test, a segment that starts inside the box does not hit it.
+    lower = 0
+    upper = 1
+    entered = False
+    for origin, delta, center, half_size in ((x, dx, center_x, half_width),
+                                             (y, dy, center_y, half_height)):
+        if delta:
+            t1 = (center - half_size - origin) / delta
+            t2 = (center + half_size - origin) / delta
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > lower:
+                lower = t1
+                entered = True
+            upper = min(upper, t2)
+            if lower > upper:
+                return None
+        elif abs(origin - center) > half_size:
+            return None
+    return lower if entered else None
@@ -22,12 +22,58 @@ camera_min_y = 3
 camera_max_y = 100
 fade_tone_duration = 2
 fade_alpha_duration = 2
-cloud_count = 50
-cloud_min_y = 10
-cloud_max_y = 90
-cloud_max_x = 50
-cloud_min_dx = 0.5
-cloud_max_dx = 1.5
+cloud_count = None
 sun_melt_distance = 100
 shadow_length = 20
 immortal = False
+seed = None
+record = None
+replay = None
+cloud_cell_size = 5
+texture_atlas = True
+asset_stats = False
+cloud_pool_capacity = 100
+cloud_park_y = -5
+max_substeps = 5
+drop_time = True
+profile = False
+profile_frames = 600
+profile_csv = None
+cloud_sync_margin = 2
+level = None
+level_cache_dir = None
+level_chunk_size = 20
+stream_distance = 30
+stream_urgent_distance = 5
+stream_budget = 20
+sound = True
+voice_count = 8
+channel_volumes = {'master': 1, 'effects': 1, 'ambience': 1, 'jingles': 1}
+preload_sounds = True
+streamed_sounds = ['sounds/wind.wav', 'sounds/heartbeat.wav']
+static_map = True
+static_map_cell_size = 1
+show_static_map = False
+static_map_colors = {
+    'ground': (0.2, 0.8, 0.2, 0.4),
+    'shade': (0.2, 0.2, 0.8, 0.4),
+    'near': (0.2, 0.2, 0.8, 0.15),
+}
+latency_samples = 100
+checkpoints = True
+snapshot_interval = 1
+snapshot_count = 30
+retry_rewind = 2
+rest_linear_tolerance = 0.01
+rest_angular_tolerance = 0.035
+rest_angle_tolerance = 0.01
+screenshot = 'pycarus-screenshot.png'
+capture_frames = False
+capture_dir = 'pycarus-frames'
+capture_interval = 2
+capture_format = 'raw'
+capture_buffers = 3
+capture_queue_size = 8
+sun_path = None
+sun_shadow_threshold = 0.1
+shadow_error = 0.05
@@ -0,0 +1,256 @@
+from __future__ import division
+
+import cloudindex
+import config
+import profiler
+from replay import Recording, Script
+from simulation import Simulation
+from snapshots import SnapshotRing, snapshot_size
+from staticmap import StaticMap
+import streaming
+
+import ast
+import Box2D
+import inspect
+import optparse
+import sys
+import time
+
+def parse_args(args):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--ticks', type='int', default=3600,
+                      help='number of ticks to simulate')
+    parser.add_option('--script', help='scripted input file')
+    parser.add_option('--seed', type='int', help='random seed')
+    parser.add_option('--record', metavar='FILE',
+                      help='record the run to a replay file')
+    parser.add_option('--replay', metavar='FILE',
+                      help='replay a recorded run at full speed')
+    parser.add_option('--check-shadows', action='store_true',
+                      help='compare the shadow test against a Box2D raycast')
+    parser.add_option('--cloud-count', type='int',
+                      help="override the level's cloud count")
+    parser.add_option('--level', metavar='FILE', help='level file to load')
+    parser.add_option('--immortal', action='store_true',
+                      help='keep Icarus from melting or tiring')
+    parser.add_option('--profile', metavar='FILE',
+                      help='write per-tick profiler samples to a CSV file')
+    parser.add_option('--check-allocations', action='store_true',
+                      help='check that ticks leave no memory allocated')
+    parser.add_option('--check-snapshots', action='store_true',
+                      help='check that restoring a snapshot replays the same')
+    parser.add_option('--no-static-map', action='store_true',
+                      help='raycast static clouds and ground every tick')
+    parser.add_option('--sun-path', metavar='KEYFRAMES',
+                      help='move the sun along keyframes of (time, dx, dy)')
+    return parser.parse_args(args)
+
+def check_shadows(simulation, ticks, script):
+    # Step the simulation and compare the analytic shadow test with the Box2D
+    # raycast it replaced after every tick, and the ground in the static map
+    # with the ground raycast. The raycasts only see the chunks that are
+    # streamed in, so this also checks that the streamer keeps up.
+    icarus = simulation.icarus
+    static_map = simulation.static_map
+    simulation.script = script
+    analytic_time = 0
+    raycast_time = 0
+    mismatches = 0
+    ground_mismatches = 0
+    for _ in range(ticks):
+        simulation.step()
+        simulation.cloud_field.sync_all()
+        start = time.time()
+        icarus.update_cloud_distance()
+        analytic_time += time.time() - start
+        start = time.time()
+        cloud_distance = icarus.raycast_cloud_distance()
+        raycast_time += time.time() - start
+        # Bodies hold single precision positions. Past the shadow length any
+        # distance means melting, and the static map doesn't tell them apart.
+        melting = icarus.cloud_distance > config.shadow_length
+        error = abs(cloud_distance - icarus.cloud_distance)
+        if (melting != (cloud_distance > config.shadow_length) or
+            not melting and error > 1e-3):
+            mismatches += 1
+        if (static_map is not None and
+            not static_map.has_ground(icarus.body.position.tuple()) and
+            icarus.raycast_ground()):
+            ground_mismatches += 1
+    sys.stdout.write('shadow mismatches: %d\n' % mismatches)
+    sys.stdout.write('ground mismatches: %d\n' % ground_mismatches)
+    sys.stdout.write('analytic shadow test: %.1f us per tick\n' %
+                     (analytic_time / max(ticks, 1) * 1e6))
+    sys.stdout.write('raycast shadow test: %.1f us per tick\n' %
+                     (raycast_time / max(ticks, 1) * 1e6))
+    return mismatches + ground_mismatches
+
+def allocation_filters():
+    # What a tick may legitimately leave behind, each traced through the
+    # whole call stack: chunks streaming in and out, clouds moving between
+    # index cells, new clouds taking the place of expired ones, the tiles
+    # the static map keeps around Icarus, the profiler's timers and the
+    # contacts and proxies Box2D keeps between steps. Anything else that
+    # grows is a leak.
+    import tracemalloc
+    filters = [tracemalloc.Filter(False, module.__file__, all_frames=True)
+               for module in (tracemalloc, streaming, cloudindex, profiler,
+                              Box2D)]
+    for function in (Simulation.create_clouds, StaticMap.create_tile,
+                     StaticMap.shade_candidates):
+        filename = inspect.getsourcefile(function)
+        lines, first = inspect.getsourcelines(function)
+        filters.extend(tracemalloc.Filter(False, filename, lineno,
+                                          all_frames=True)
+                       for lineno in range(first, first + len(lines)))
+    return filters
+
+def check_allocations(simulation, ticks, script):
+    # Run the first half of the ticks to let the simulation settle, then
+    # compare what is allocated before and after the second half. Tracing
+    # starts with the first half so that objects replaced in the second half
+    # were traced too. Leaving out what allocation_filters names, the
+    # second half must not leave a single block behind.
+    try:
+        import tracemalloc
+    except ImportError:
+        sys.stdout.write('allocation check needs tracemalloc\n')
+        return 0
+    simulation.script = script
+    traced_ticks = ticks - ticks // 2
+    tracemalloc.start(8)
+    try:
+        for _ in range(ticks // 2):
+            simulation.step()
+        before = tracemalloc.take_snapshot()
+        for _ in range(traced_ticks):
+            simulation.step()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    filters = allocation_filters()
+    stats = after.filter_traces(filters).compare_to(
+        before.filter_traces(filters), 'lineno')
+    growth = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    sys.stdout.write('net allocations: %d bytes, %d blocks over %d ticks\n' %
+                     (growth, blocks, traced_ticks))
+    sys.stdout.write('peak traced memory: %d bytes\n' % peak)
+    for stat in stats[:12]:
+        if stat.size_diff or stat.count_diff:
+            sys.stdout.write('    %s\n' % stat)
+            for line in stat.traceback.format()[-4:]:
+                sys.stdout.write('    %s\n' % line)
+    return int(growth != 0 or blocks != 0)
+
+def comparable(snapshot):
+    # Restoring renumbers the cloud events, so compare their order rather
+    # than their numbers. Streaming shuffles the order of the clouds in the
+    # index, which only matters for exact ties, so compare them sorted.
+    tick, clouds = snapshot['clouds']
+    ranks = dict((event, rank) for rank, event in
+                 enumerate(sorted(cloud[5] for cloud in clouds)))
+    snapshot = dict(snapshot)
+    snapshot['clouds'] = tick, sorted(cloud[:5] + (ranks[cloud[5]],)
+                                      for cloud in clouds)
+    return snapshot
+
+def check_snapshots(simulation, ticks, script):
+    # Take a snapshot halfway, run to the end, then restore it and run the
+    # second half again. The world should end up the same both times.
+    simulation.script = script
+    for _ in range(ticks // 2):
+        simulation.step()
+    snapshots = SnapshotRing(1)
+    snapshot = snapshots.capture(simulation)
+    simulation.run(ticks - ticks // 2)
+    expected = comparable(simulation.snapshot())
+    snapshots.restore(simulation, snapshot)
+    simulation.run(ticks - ticks // 2)
+    actual = comparable(simulation.snapshot())
+    different = sorted(name for name in expected
+                       if actual[name] != expected[name])
+    sys.stdout.write('snapshot size: %d bytes\n' % snapshot_size(snapshot))
+    sys.stdout.write('snapshot capture: %.0f us, restore: %.0f us\n' %
+                     (snapshots.capture_times.percentile(50) * 1e6,
+                      snapshots.restore_times.percentile(50) * 1e6))
+    sys.stdout.write('snapshot mismatches: %s\n' %
+                     (', '.join(different) or 'none'))
+    return len(different)
+
+def main(args=None):
+    options, _ = parse_args(sys.argv[1:] if args is None else args)
+    if options.cloud_count is not None:
+        config.cloud_count = options.cloud_count
+    if options.immortal:
+        config.immortal = True
+    if options.level:
+        config.level = options.level
+    if options.no_static_map:
+        config.static_map = False
+    if options.sun_path:
+        config.sun_path = ast.literal_eval(options.sun_path)
+    seed = options.seed
+    ticks = options.ticks
+    script = Script.load(options.script) if options.script else None
+    if options.replay:
+        recording = Recording.load(options.replay)
+        seed = recording.seed
+        ticks = recording.ticks
+        script = recording.script()
+    if options.profile:
+        # Keep a sample for every tick of the run.
+        config.profile_frames = ticks
+    simulation = Simulation(seed=seed)
+    if options.record:
+        simulation.recording = Recording(simulation.seed)
+    start = time.time()
+    failures = 0
+    if options.check_shadows:
+        failures = check_shadows(simulation, ticks, script)
+    elif options.check_allocations:
+        failures = check_allocations(simulation, ticks, script)
+    elif options.check_snapshots:
+        failures = check_snapshots(simulation, ticks, script)
+    elif options.profile:
+        simulation.script = script
+        for _ in range(ticks):
+            simulation.step()
+            simulation.profiler.end_frame()
+    else:
+        simulation.run(ticks, script)
+    duration = time.time() - start
+    if options.record:
+        simulation.recording.save(options.record)
+    if options.profile:
+        simulation.profiler.dump(options.profile)
+    position = simulation.icarus.body.position
+    sys.stdout.write('seed: %d\n' % simulation.seed)
+    sys.stdout.write('ticks: %d\n' % simulation.ticks)
+    sys.stdout.write('seconds: %.3f\n' % duration)
+    sys.stdout.write('ticks per second: %.0f\n' %
+                     (simulation.ticks / max(duration, 1e-9)))
+    sys.stdout.write('state: %s\n' % simulation.icarus.state)
+    sys.stdout.write('position: %.2f %.2f\n' % (position.x, position.y))
+    sys.stdout.write('damage: %.3f fatigue: %.3f\n' %
+                     (simulation.icarus.damage, simulation.icarus.fatigue))
+    sys.stdout.write('bodies simulated: %.2f per tick, %d steps skipped\n' %
+                     (simulation.simulated_bodies / max(simulation.ticks, 1),
+                      simulation.skipped_steps))
+    pool = simulation.cloud_pool
+    sys.stdout.write('cloud pool: %d allocations, %d reuses, %d misses\n' %
+                     (pool.allocations, pool.reuses, pool.misses))
+    streamer = simulation.streamer
+    sys.stdout.write('chunks: %d of %d loaded, %d bodies, '
+                     '%d created, %d destroyed\n' %
+                     (len(streamer), len(simulation.level.chunks),
+                      streamer.body_count(), streamer.created,
+                      streamer.destroyed))
+    if options.profile:
+        sys.stdout.write('\n'.join(simulation.profiler.report()) + '\n')
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
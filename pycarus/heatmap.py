@@ -0,0 +1,31 @@
+from __future__ import division
+
+import config
+from render import QuadBatch, copy_array, overlaps
+
+import numpy
+
+class HeatmapBatch(QuadBatch):
+    # Debug overlay of the static map: the cells with ground, the cells in
+    # static shade and the cells that static clouds could shade some of.
+    def __init__(self, static_map):
+        super(HeatmapBatch, self).__init__()
+        cells = static_map.heatmap(config.shadow_length)
+        self.quads = numpy.array([(x1, y1, x2, y1, x2, y2, x1, y2)
+                                  for x1, y1, x2, y2, _ in cells],
+                                 dtype=numpy.float64).reshape(-1, 8)
+        self.colors = numpy.array([config.static_map_colors[kind]
+                                   for _, _, _, _, kind in cells],
+                                  dtype=numpy.float64).reshape(-1, 4)
+
+    def update(self, lower, upper):
+        # Cells outside the rectangle from lower to upper are culled.
+        # Returns the number of culled cells.
+        visible = overlaps(self.quads, lower, upper)
+        quads = self.quads[visible]
+        colors = self.colors[visible]
+        self.set_quads(quads)
+        if len(colors):
+            copy_array(self.vertex_list.colors,
+                       numpy.repeat(colors, 4, axis=0))
+        return len(visible) - len(quads)
@@ -0,0 +1,43 @@
+from __future__ import division
+
+from collections import deque
+
+class InputQueue(object):
+    # Key events stamped with the game time they happened at. Each one is
+    # held until the first tick that starts at or after its time and is
+    # applied at the start of that tick, so an event always lands on the
+    # same tick however the frames and ticks happen to line up. The wall
+    # clock time of each press is passed on once applied, for measuring
+    # latency.
+    def __init__(self, dt):
+        self.dt = dt
+        self.events = deque()
+        self.applied = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def push(self, time, control, pressed, wall_time):
+        self.events.append((time, control, pressed, wall_time))
+
+    def shift(self, delta):
+        # Move the pending events along with a game clock that has dropped
+        # time.
+        self.events = deque((time + delta, control, pressed, wall_time)
+                            for time, control, pressed, wall_time
+                            in self.events)
+
+    def apply(self, tick, icarus):
+        start = tick * self.dt
+        events = self.events
+        while events and events[0][0] <= start:
+            _, control, pressed, wall_time = events.popleft()
+            if pressed:
+                icarus.press(control)
+                self.applied.append(wall_time)
+            else:
+                icarus.release(control)
+
+    def clear(self):
+        self.events.clear()
+        del self.applied[:]
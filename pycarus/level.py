@@ -0,0 +1,198 @@
+from __future__ import division
+
+import config
+
+import hashlib
+import json
+from math import *
+import numpy
+import os
+import struct
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'levels', 'default.json')
+
+# The compiled form: a header, a table of chunks and then the temple and
+# cloud positions as little-endian doubles, sorted by chunk so that each
+# chunk is a contiguous slice.
+magic = b'PCLV'
+version = 2
+header_format = struct.Struct('<4sI4d2d2d2d2dd5d4I')
+chunk_format = struct.Struct('<ii4I')
+
+# A temple stands on a cloud this far below it. Temples go in the chunk that
+# holds their cloud, since that is what the streamer loads.
+temple_cloud_drop = 1.5
+
+class Level(object):
+    # A level as loaded from its compiled form. The temples and static
+    # clouds are split into square chunks.
+    def __init__(self):
+        self.temples = numpy.zeros((0, 2))
+        self.clouds = numpy.zeros((0, 2))
+        self.chunks = {}
+        self.items = {}
+        # Where the compiled level came from, for caching what is built
+        # from it.
+        self.cache_dir = None
+
+    def chunk_key(self, position):
+        return chunk_key(position, self.chunk_size)
+
+    def chunks_in(self, lower, upper):
+        # The keys of the chunks that overlap the rectangle from lower to
+        # upper and hold anything.
+        min_i, min_j = self.chunk_key(lower)
+        max_i, max_j = self.chunk_key(upper)
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self.chunks):
+            return [key for key in self.chunks
+                    if min_i <= key[0] <= max_i and min_j <= key[1] <= max_j]
+        return [(i, j) for j in range(min_j, max_j + 1)
+                for i in range(min_i, max_i + 1) if (i, j) in self.chunks]
+
+    def chunk_distance(self, key, position):
+        # Distance from a point to the nearest point of a chunk.
+        i, j = key
+        x, y = position
+        dx = max(i * self.chunk_size - x, 0, x - (i + 1) * self.chunk_size)
+        dy = max(j * self.chunk_size - y, 0, y - (j + 1) * self.chunk_size)
+        return sqrt(dx * dx + dy * dy)
+
+    def chunk_items(self, key):
+        # The temples and static clouds of a chunk as (temple, position)
+        # pairs, in the order the streamer creates them.
+        items = self.items.get(key)
+        if items is None:
+            items = ([(True, tuple(position))
+                      for position in self.chunk_temples(key).tolist()] +
+                     [(False, tuple(position))
+                      for position in self.chunk_clouds(key).tolist()])
+            self.items[key] = items
+        return items
+
+    def temples_in(self, lower, upper):
+        # Temples whose clouds are in the chunks that overlap the rectangle
+        # lowered by the cloud drop.
+        (min_x, min_y), (max_x, max_y) = lower, upper
+        temples = [self.chunk_temples(key) for key in self.chunks_in(
+            (min_x, min_y - temple_cloud_drop),
+            (max_x, max_y - temple_cloud_drop))]
+        if not temples:
+            return numpy.zeros((0, 2))
+        return numpy.vstack(temples)
+
+    def chunk_temples(self, key):
+        start, count, _, _ = self.chunks[key]
+        return self.temples[start:start + count]
+
+    def chunk_clouds(self, key):
+        _, _, start, count = self.chunks[key]
+        return self.clouds[start:start + count]
+
+    @classmethod
+    def load(cls, path=None):
+        # Levels are read from the compiled cache when it holds a copy of
+        # the same source, compiled with the same settings, and compiled
+        # into it otherwise. The key covers the configured chunk size even
+        # for sources that set their own, rather than parse them first.
+        path = path or default_path
+        source = open(path, 'rb').read()
+        key = hashlib.sha1(source + struct.pack('<Id', version,
+                                                config.level_chunk_size)
+                           ).hexdigest()
+        cache_dir = config.level_cache_dir or os.path.join(
+            os.path.dirname(path), 'cache')
+        cache_path = os.path.join(cache_dir, key + '.bin')
+        if os.path.exists(cache_path):
+            level = cls.parse(open(cache_path, 'rb').read())
+            level.cache_dir = cache_dir
+            return level
+        data = compile_level(json.loads(source.decode('utf-8')))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            out = open(cache_path, 'wb')
+            try:
+                out.write(data)
+            finally:
+                out.close()
+        except (IOError, OSError):
+            pass
+        level = cls.parse(data)
+        level.cache_dir = cache_dir
+        return level
+
+    @classmethod
+    def parse(cls, data):
+        fields = header_format.unpack_from(data)
+        if fields[0] != magic or fields[1] != version:
+            raise ValueError('not a compiled pycarus level')
+        level = cls()
+        values = fields[2:]
+        level.bounds = tuple(values[0:2]), tuple(values[2:4])
+        level.sun = tuple(values[4:6])
+        level.island = tuple(values[6:8])
+        level.start = tuple(values[8:10])
+        level.pearly_gates = tuple(values[10:12])
+        level.chunk_size = values[12]
+        (level.cloud_min_y, level.cloud_max_y, level.cloud_max_x,
+         level.cloud_min_dx, level.cloud_max_dx) = values[13:18]
+        level.cloud_count = values[18]
+        temple_count, cloud_count, chunk_count = values[19:22]
+        offset = header_format.size
+        for _ in range(chunk_count):
+            i, j, temple_start, temples, cloud_start, clouds = \
+                chunk_format.unpack_from(data, offset)
+            level.chunks[i, j] = temple_start, temples, cloud_start, clouds
+            offset += chunk_format.size
+        level.temples = numpy.frombuffer(data, dtype='<f8',
+                                         count=2 * temple_count,
+                                         offset=offset).reshape(-1, 2)
+        offset += 16 * temple_count
+        level.clouds = numpy.frombuffer(data, dtype='<f8',
+                                        count=2 * cloud_count,
+                                        offset=offset).reshape(-1, 2)
+        return level
+
+def chunk_key(position, chunk_size):
+    x, y = position
+    return int(floor(x / chunk_size)), int(floor(y / chunk_size))
+
+def compile_level(source):
+    # Turns the JSON description of a level into its compiled form.
+    chunk_size = source.get('chunk_size', config.level_chunk_size)
+    cloud_field = source.get('cloud_field', {})
+    chunks = {}
+    for kind, positions in (('temples', source.get('temples', [])),
+                            ('clouds', source.get('clouds', []))):
+        for position in positions:
+            x, y = position
+            if kind == 'temples':
+                y -= temple_cloud_drop
+            key = chunk_key((x, y), chunk_size)
+            chunks.setdefault(key, {'temples': [], 'clouds': []})
+            chunks[key][kind].append(position)
+    table = []
+    temples = []
+    clouds = []
+    for key in sorted(chunks):
+        chunk = chunks[key]
+        table.append(chunk_format.pack(key[0], key[1], len(temples),
+                                       len(chunk['temples']), len(clouds),
+                                       len(chunk['clouds'])))
+        temples.extend(chunk['temples'])
+        clouds.extend(chunk['clouds'])
+    (min_x, min_y), (max_x, max_y) = source['bounds']
+    header = header_format.pack(
+        magic, version, min_x, min_y, max_x, max_y,
+        source['sun'][0], source['sun'][1],
+        source['island'][0], source['island'][1],
+        source['start'][0], source['start'][1],
+        source['pearly_gates'][0], source['pearly_gates'][1], chunk_size,
+        cloud_field.get('min_y', 10), cloud_field.get('max_y', 90),
+        cloud_field.get('max_x', 50), cloud_field.get('min_dx', 0.5),
+        cloud_field.get('max_dx', 1.5), cloud_field.get('count', 39),
+        len(temples), len(clouds), len(table))
+    return b''.join([header] + table +
+                    [numpy.array(temples, dtype='<f8').tobytes(),
+                     numpy.array(clouds, dtype='<f8').tobytes()])
@@ -1,30 +1,38 @@
 from __future__ import division
 
+from assets import assets
 import b2
+from capture import FrameCapture
 import config
-import sfx
+from heatmap import HeatmapBatch
+from mixer import Mixer
+from profiler import LatencyMeter, timer
+from replay import Recording
+from render import RenderStats, SpriteBatch
+from sfx import SoundEffects, sounds
+from shadows import ShadowBatch
+from simulation import Simulation, UP, LEFT, RIGHT, clamp
+from snapshots import SnapshotRing
 
 from math import *
+import numpy
 import pyglet
 from pyglet.gl import *
+import optparse
+import os
 import rabbyt
-import random
 import sys
 
-def save_screenshot(name='screenshot.png', format='RGB'):
-    image = pyglet.image.get_buffer_manager().get_color_buffer().image_data
-    image.format = format
-    image.save(name)
-
-def clamp(x, min_x, max_x):
-    return max(min_x, min(max_x, x))
-
-def normalize_signed_angle(angle):
-    while angle < -pi:
-        angle += 2 * pi
-    while angle >= pi:
-        angle -= 2 * pi
-    return angle
+# The small sprites drawn in batches share a texture atlas.
+packed_images = [
+    'images/cloud.png',
+    'images/island.png',
+    'images/temple.png',
+]
+images = packed_images + [
+    'images/icarus-flying.png',
+    'images/icarus-walking.png',
+]
 
 class Screen(object):
     def __init__(self, window):
@@ -35,10 +43,17 @@ class Screen(object):
         self.window.pop_handlers()
 
 class TitleScreen(Screen):
-    def __init__(self, window):
+    def __init__(self, window, sound):
         super(TitleScreen, self).__init__(window)
-        texture = pyglet.resource.texture('images/title.jpg')
+        self.sound = sound
+        texture = assets.texture('images/title.jpg')
         self.sprite = rabbyt.Sprite(texture)
+        # Sounds are otherwise loaded when first played.
+        names = list(images)
+        if config.preload_sounds:
+            names += [name for name in sounds
+                      if name not in config.streamed_sounds]
+        assets.preload(names)
 
     def on_draw(self):
         self.window.clear()
@@ -55,339 +70,77 @@ class TitleScreen(Screen):
             self.delete()
             self.window.close()
         if symbol == pyglet.window.key.ENTER:
-            GameScreen(self.window)
+            GameScreen(self.window, self.sound)
         return pyglet.event.EVENT_HANDLED
 
-class Actor(object):
-    def step(self, dt):
-        pass
-
-    def draw(self):
-        pass
-
-class Sun(Actor):
-    def __init__(self, game_screen, position=(0, 0)):
-        self.game_screen = game_screen
-        self.position = position
-
-class Icarus(Actor):
-    def __init__(self, game_screen, position=(0, 0)):
-        self.game_screen = game_screen
-        self.init_body(position)
-        self.init_sprite()
-        self.keys = set()
-        self.sun_distance = 1000
-        self.cloud_distance = 1000
-        
-        self.damage = 0
-        self.fatigue = 0
-        self.state = 'flying'
-        self.facing = 1
-        self.immortal = config.immortal
-        self.melting = False
-        self.flapped = False
-
-    def init_body(self, position):
-        body_def = b2.b2BodyDef()
-        body_def.position = position
-        self.body = self.game_screen.world.CreateBody(body_def)
-        self.body.userData = self
-        shape_def = b2.b2CircleDef()
-        shape_def.radius = 0.5
-        shape_def.density = 1
-        self.body.CreateShape(shape_def)
-        self.body.SetMassFromShapes()
-
-    def init_sprite(self):
-        flying_texture = pyglet.resource.texture('images/icarus-flying.png')
-        self.flying_sprite = rabbyt.Sprite(flying_texture, scale=0.02)
-        walking_texture = pyglet.resource.texture('images/icarus-walking.png')
-        self.walking_sprite = rabbyt.Sprite(walking_texture, scale=0.03)
-        self.sprite = self.flying_sprite
-
-    def delete(self):
-        self.game_screen.world.DestroyBody(self.body)
-
-    def draw(self):
-        if self.state in ('standing', 'walking'):
-            self.sprite = self.walking_sprite
-        else:
-            self.sprite = self.flying_sprite
-        self.sprite.xy = self.body.position.tuple()
-        self.sprite.rot = self.body.angle * 180 / pi
-        self.sprite.scale_x = self.facing * abs(self.sprite.scale_x)
-        self.sprite.green = 1 - clamp(self.damage, 0, 1)
-        self.sprite.blue = 1 - clamp(self.damage, 0, 1)
-        self.sprite.render()
-
-    def step(self, dt):
-        old_state = self.state
-        if self.cloud_distance > config.shadow_length and not self.immortal:
-            if not self.melting:
-                self.melting = True
-                sfx.sizzle()
-            self.damage = (dt / self.sun_distance / config.melt_duration +
-                           clamp(self.damage, 0, 1))
-        else:
-            if self.melting:
-                self.melting = False
-                sfx.sizzle_stop()
-        self.update_distances()
-        self.update_state()
-        if self.state == 'standing':
-            self.step_standing(dt)
-        elif self.state == 'walking':
-            self.step_walking(dt)
-        elif self.state == 'flying':
-            self.step_flying(dt)
-        elif self.state == 'falling':
-            self.step_falling(dt)
-        if self.state != old_state:
-            self.update_sound(old_state)
-        if self.state == 'flying' and not self.flapped:
-            sfx.flap()
-            self.flapped = True
-            pyglet.clock.schedule_once(self.clear_flapped, 1)
-
-    def clear_flapped(self, dt):
-        self.flapped = False
-
-    def update_sound(self, old_state):
-        if old_state == 'walking':
-            sfx.walk_stop()
-        if self.state == 'walking':
-            sfx.walk()
-
-    def update_distances(self):
-        self.update_sun_distance()
-        self.update_cloud_distance()
-
-    def update_sun_distance(self):
-        sun_position = b2.b2Vec2(*self.game_screen.sun.position)
-        self.sun_distance = (self.body.position - sun_position).Length()
-
-    def update_cloud_distance(self):
-        segment = b2.b2Segment()
-        segment.p1 = self.body.position
-        segment.p2 = self.game_screen.sun.position
-        _, _, shape = self.game_screen.world.RaycastOne(segment, False, None)
-        if shape is not None and isinstance(shape.GetBody().userData, Cloud):
-            cloud_position = shape.GetBody().position
-            self.cloud_distance = (self.body.position -
-                                   cloud_position).Length()
-        else:
-            self.cloud_distance = 1000
-
-    def update_state(self):
-        if (not self.immortal and (self.damage >= 1 or self.fatigue >= 1) or
-            self.body.position.y <= 0):
-            self.state = 'falling'
-        elif pyglet.window.key.UP in self.keys:
-            self.state = 'flying'
-        else:
-            # See if there's any ground beneath Icarus's feet.
-            segment = b2.b2Segment()
-            segment.p1 = self.body.position
-            segment.p2 = segment.p1 + b2.b2Vec2(0, -0.6)
-            _, _, shape = self.game_screen.world.RaycastOne(segment, False,
-                                                            None)
-            if shape is not None and not shape.isSensor:
-                if self.state not in ('standing', 'walking'):
-                    self.state = 'standing'
-            else:
-                self.state = 'flying'
-
-    def step_standing(self, dt):
-        # Rest on the ground.
-        self.fatigue = clamp(self.fatigue, 0, 1) - dt / config.rest_duration
-
-        left = pyglet.window.key.LEFT in self.keys
-        right = pyglet.window.key.RIGHT in self.keys
-        if left or right:
-            self.state = 'walking'
-        force = -self.body.linearVelocity
-        self.body.ApplyForce(force, self.body.position)
-        torque = -(self.body.angle * config.icarus_angular_k +
-                   self.body.angularVelocity * config.icarus_angular_damping)
-        self.body.ApplyTorque(torque)
-
-    def step_walking(self, dt):
-        # Rest on the ground.
-        self.fatigue = clamp(self.fatigue, 0, 1) - dt / config.rest_duration
-
-        left = pyglet.window.key.LEFT in self.keys
-        right = pyglet.window.key.RIGHT in self.keys
-        if not left and not right:
-            self.state = 'standing'
-            return
-        if left ^ right:
-            self.facing = right - left
-        force = b2.b2Vec2(right - left, 0) * 10 - self.body.linearVelocity
-        self.body.ApplyForce(force, self.body.position)
-        torque = -(self.body.angle * config.icarus_angular_k +
-                   self.body.angularVelocity * config.icarus_angular_damping)
-        self.body.ApplyTorque(torque)
-
-    def step_flying(self, dt):
-        up = pyglet.window.key.UP in self.keys
-        left = pyglet.window.key.LEFT in self.keys
-        right = pyglet.window.key.RIGHT in self.keys
-        if up or left or right:
-            # Grow tired from flapping those wings.
-            self.fatigue = (dt / config.flight_duration +
-                            clamp(self.fatigue, 0, 1))
-        if left ^ right:
-            self.facing = right - left
-
-        # Fatigue and damage affect flight capabilities.
-        fatigue_factor = 1 - 2 * clamp(self.fatigue - 0.5, 0, 0.5)
-        damage_factor = 1 - 2 * clamp(self.damage - 0.5, 0, 0.5)
-        lift_force = up * fatigue_factor * damage_factor * config.icarus_lift_force
-
-        side_force = (right - left) * config.icarus_side_force
-        left = pyglet.window.key.LEFT in self.keys
-        right = pyglet.window.key.LEFT in self.keys
-        air_force = -(self.body.linearVelocity * config.icarus_air_resistance)
-        self.body.ApplyForce(b2.b2Vec2(side_force, lift_force) + air_force,
-                             self.body.position)
-        torque = -(self.body.angle * config.icarus_angular_k +
-                   self.body.angularVelocity * config.icarus_angular_damping)
-        self.body.ApplyTorque(torque)
-
-    def step_falling(self, dt):
-        angle_error = normalize_signed_angle(pi - self.body.angle)
-        torque = (angle_error * config.icarus_angular_k -
-                  self.body.angularVelocity * config.icarus_angular_damping)
-        self.body.ApplyTorque(torque)
-
-    def on_key_press(self, symbol, modifiers):
-        self.keys.add(symbol)
-    
-    def on_key_release(self, symbol, modifiers):
-        self.keys.discard(symbol)
-
-class Cloud(Actor):
-    def __init__(self, game_screen, position=(0, 0), linear_velocity=(0, 0),
-                 sensor=True, static=False):
-        self.game_screen = game_screen
-        self.width = 4.5
-        self.init_body(position, linear_velocity, sensor, static)
-        self.init_sprite()
-
-    def init_body(self, position, linear_velocity, sensor, static):
-        body_def = b2.b2BodyDef()
-        body_def.position = position
-        self.body = self.game_screen.world.CreateBody(body_def)
-        self.body.userData = self
-        shape_def = b2.b2PolygonDef()
-        shape_def.SetAsBox(self.width / 2, config.cloud_height / 2)
-        shape_def.isSensor = sensor
-        shape_def.density = 1
-        self.body.CreateShape(shape_def)
-        if static:
-            self.mass = 0
-        else:
-            self.body.SetMassFromShapes()
-            self.mass = self.body.massData.mass
-            self.body.linearVelocity = linear_velocity
-
-    def init_sprite(self):
-        texture = pyglet.resource.texture('images/cloud.png')
-        self.sprite = rabbyt.Sprite(texture, scale=0.02)
-
-    def delete(self):
-        self.game_screen.world.DestroyBody(self.body)
-
-    def draw_shadow(self):
-        sun_position = b2.b2Vec2(*self.game_screen.sun.position)
-        cloud_position = self.body.position
-        top_left = cloud_position - b2.b2Vec2(self.width / 2, 0)
-        top_right = cloud_position + b2.b2Vec2(self.width / 2, 0)
-        left_slope = top_left - sun_position
-        left_slope.Normalize()
-        right_slope = top_right - sun_position
-        right_slope.Normalize()
-        bottom_left = top_left + left_slope * config.shadow_length
-        bottom_right = top_right + right_slope * config.shadow_length
-        glBindTexture(GL_TEXTURE_2D, 0)
-        glBegin(GL_QUADS)
-        red, green, blue = config.shadow_color
-        glColor4f(red, green, blue, 1)
-        glVertex2f(top_left.x, top_left.y)
-        glVertex2f(top_right.x, top_right.y)
-        glColor4f(red, green, blue, 0)
-        glVertex2f(bottom_right.x, bottom_right.y)
-        glVertex2f(bottom_left.x, bottom_left.y)
-        glEnd()
-
-    def draw(self):
-        self.sprite.xy = self.body.position.tuple()
-        self.sprite.render()
-
-    def step(self, dt):
-        anti_gravity_force = self.mass * config.gravity
-        self.body.ApplyForce((0, anti_gravity_force), self.body.position)
-        linear_velocity = self.body.linearVelocity
-        linear_velocity.y = 0
-        self.body.linearVelocity = linear_velocity
-
-class Island(Actor):
-    def __init__(self, game_screen, position=(0, 0)):
-        self.game_screen = game_screen
-        self.init_body(position)
-        self.init_sprite()
-
-    def init_body(self, position):
-        body_def = b2.b2BodyDef()
-        body_def.position = position
-        self.body = self.game_screen.world.CreateBody(body_def)
-        shape_def = b2.b2PolygonDef()
-        shape_def.SetAsBox(3.5, 1)
-        self.body.CreateShape(shape_def)
-
-    def init_sprite(self):
-        texture = pyglet.resource.texture('images/island.png')
-        self.sprite = rabbyt.Sprite(texture, scale=0.02)
-
-    def delete(self):
-        self.game_screen.world.DestroyBody(self.body)
-
-    def draw(self):
-        self.sprite.xy = (self.body.position +
-                          b2.b2Vec2(*config.island_offset)).tuple()
-        self.sprite.render()
-
 class GameScreen(Screen):
-    def __init__(self, window):
+    key_controls = {
+        pyglet.window.key.UP: UP,
+        pyglet.window.key.LEFT: LEFT,
+        pyglet.window.key.RIGHT: RIGHT,
+    }
+
+    def __init__(self, window, sound):
         super(GameScreen, self).__init__(window)
+        self.sound = sound
         self.clock_display = pyglet.clock.ClockDisplay()
 
         self.init_time()
-
-        self.clouds = []
-        self.temples = []
-        self.init_world()
-        self.init_level()
+        self.init_simulation()
+        self.init_sprites()
         self.init_fade()
-        self.icarus = Icarus(self, (2, 1.5))
+        self.init_capture()
 
         self.losing = False
         self.winning = False
-        pyglet.clock.schedule_interval(self.step, self.dt)
-        sfx.wind()
-        sfx.start()
+        pyglet.clock.schedule_interval(self.step, self.simulation.dt)
+        self.sound.wind()
+        self.sound.start()
 
     def delete(self):
-        sfx.pause_all()
+        self.sound.pause_all()
+        if self.simulation.recording is not None:
+            self.simulation.recording.save(config.record)
+        if config.profile_csv:
+            self.profiler.dump(config.profile_csv)
         pyglet.clock.unschedule(self.step)
         pyglet.clock.unschedule(self.lose)
         pyglet.clock.unschedule(self.win)
+        for batch in (self.shadow_batch, self.cloud_batch, self.island_batch,
+                      self.temple_batch):
+            batch.delete()
+        if self.heatmap_batch is not None:
+            self.heatmap_batch.delete()
+        self.capture.delete()
         super(GameScreen, self).delete()
 
     def init_time(self):
         self.time = 0
-        self.dt = 1 / 60
-        self.world_time = 0
+        self.step_wall_time = timer()
+        self.substeps = 0
+        self.dropped_time = 0
+        self.alpha = 0
+        self.input_latency = LatencyMeter(config.latency_samples)
+
+    def init_simulation(self):
+        self.replaying = config.replay is not None
+        if self.replaying:
+            recording = Recording.load(config.replay)
+            self.simulation = Simulation(self.sound, recording.seed)
+            self.simulation.script = recording.script()
+        else:
+            self.simulation = Simulation(self.sound, config.seed)
+        if config.record is not None:
+            self.simulation.recording = Recording(self.simulation.seed)
+        self.icarus = self.simulation.icarus
+        self.profiler = self.simulation.profiler
+        # Checkpoints for rewinding and for retrying after a fall.
+        self.held_controls = set()
+        self.snapshot_ticks = max(1, int(round(config.snapshot_interval /
+                                               self.simulation.dt)))
+        self.snapshots = SnapshotRing(config.snapshot_count)
+        self.snapshots.capture(self.simulation)
+        self.lost_ticks = 0
 
     def init_fade(self):
         self.fade_tone = 0
@@ -396,109 +149,129 @@ class GameScreen(Screen):
         self.fade_delta_alpha = 0
         self.fade(tone=0, alpha=0)
 
-    def init_level(self):
-        self.sun = Sun(self, (0, 100))
-        self.clouds.append(Cloud(self, (5, 95), static=True))
-        self.pearly_gates_position = (10, 90)
-        self.create_pearly_gates(self.pearly_gates_position)
-        self.create_temple((-10, 80))
-        self.create_temple((-15, 70))
-        self.create_temple((10, 60))
-        self.create_temple((-20, 50))
-        self.create_temple((25, 40))
-        self.create_temple((15, 30))
-        self.create_temple((5, 20))
-        self.create_temple((-10, 10))
-        self.clouds.append(Cloud(self, (1.5, 8), static=True))
-        self.island = Island(self)
-        self.create_clouds(init=True)
-
-    def create_temple(self, position):
-        texture = pyglet.resource.texture('images/temple.png')
-        temple = rabbyt.Sprite(texture=texture, scale=0.02,
-                               xy=position)
-        self.temples.append(temple)
-        x, y = position
-        self.clouds.append(Cloud(self, (x, y - 1.5), sensor=False,
-                                 static=True))
-
-    def create_pearly_gates(self, position):
-        texture = pyglet.resource.texture('images/temple.png')
-        self.pearly_gates = rabbyt.Sprite(texture=texture, scale=0.02,
-                                          xy=position, rgb=(1, 1, 0))
-        x, y = position
-        self.clouds.append(Cloud(self, (x, y - 1.5), sensor=False,
-                                 static=True))
+    def init_capture(self):
+        self.capture = FrameCapture(self.window, config.capture_buffers,
+                                    config.capture_queue_size)
+        self.screenshot_requested = False
+        self.recording_frames = False
+        self.recorded_frames = 0
+        if config.capture_frames:
+            self.toggle_frame_recording()
+
+    def init_sprites(self):
+        flying_texture = assets.texture('images/icarus-flying.png')
+        self.flying_sprite = rabbyt.Sprite(flying_texture, scale=0.02)
+        walking_texture = assets.texture('images/icarus-walking.png')
+        self.walking_sprite = rabbyt.Sprite(walking_texture, scale=0.03)
+
+        # Everything else is drawn in one batch per texture.
+        self.render_stats = RenderStats()
+        self.shadow_batch = ShadowBatch()
+        cloud_texture = assets.texture('images/cloud.png')
+        self.cloud_batch = SpriteBatch(cloud_texture, scale=0.02)
+        island_texture = assets.texture('images/island.png')
+        self.island_batch = SpriteBatch(island_texture, scale=0.02)
+        island_position = (self.simulation.island.body.position +
+                           b2.b2Vec2(*config.island_offset)).tuple()
+        self.island_batch.update(numpy.array([island_position]))
+        temple_texture = assets.texture('images/temple.png')
+        self.temple_batch = SpriteBatch(temple_texture, scale=0.02)
+        self.stats_label = pyglet.text.Label('', x=10, y=10)
+        self.profile_label = pyglet.text.Label('', font_name='Courier New',
+                                               font_size=10, x=10,
+                                               multiline=True, width=400,
+                                               anchor_y='top')
+        self.show_profile = config.profile
+        # Built the first time it is shown.
+        self.heatmap_batch = None
+        self.show_static_map = config.show_static_map
 
     def step(self, dt):
         self.time += dt
-        if self.icarus.state == 'falling' and not self.losing:
+        self.step_wall_time = timer()
+        if self.simulation.lost() and not self.losing:
             self.losing = True
+            self.lost_ticks = self.simulation.ticks
             pyglet.clock.schedule_once(self.lose,
                                        config.fade_alpha_duration)
             self.fade(tone=0, alpha=1)
-        if (self.icarus.state == 'standing' and not self.winning
-            and abs(self.icarus.body.position.y -
-                    self.pearly_gates_position[1]) < 2):
+        if self.simulation.won() and not self.winning:
             self.winning = True
             pyglet.clock.schedule_once(self.win,
                                        config.fade_alpha_duration)
             self.fade(tone=1, alpha=1)
-            sfx.win()
-        self.step_fade(self.dt)
-        while self.world_time + self.dt <= self.time:
-            self.world_time += self.dt
-            self.icarus.step(self.dt)
-            self.sun.step(self.dt)
-            for cloud in self.clouds:
-                cloud.step(self.dt)
-            self.step_clouds(dt)
-            self.world.Step(self.dt, config.position_iterations,
-                            config.velocity_iterations)
+            self.sound.win()
+        self.step_fade(self.simulation.dt)
+        self.step_simulation()
+
+    def step_simulation(self):
+        # Catch up with the clock, but only by so many ticks per frame so a
+        # stall doesn't make the next frame late too. Time beyond that is
+        # either dropped or left for the following frames.
+        dt = self.simulation.dt
+        self.substeps = 0
+        while self.simulation.time + dt <= self.time:
+            if self.substeps == config.max_substeps:
+                if config.drop_time:
+                    lag = self.time - self.simulation.time
+                    dropped = lag - lag % dt
+                    self.time -= dropped
+                    self.dropped_time += dropped
+                    self.simulation.input_queue.shift(-dropped)
+                break
+            self.simulation.step()
+            self.substeps += 1
+            if not self.simulation.ticks % self.snapshot_ticks:
+                self.snapshots.capture(self.simulation)
+
+    def get_alpha(self):
+        # How far the clock is between the last two ticks.
+        alpha = (self.time - self.simulation.time) / self.simulation.dt
+        return clamp(alpha, 0, 1)
 
     def lose(self, dt):
+        # Retry from a checkpoint a little before the fall, or go back to
+        # the title screen if there is none.
+        if config.checkpoints and not self.replaying:
+            tick = self.lost_ticks - config.retry_rewind / self.simulation.dt
+            snapshot = self.snapshots.latest(tick, safe=True)
+            if snapshot is not None:
+                self.restore(snapshot)
+                return
         self.delete()
 
+    def rewind(self):
+        # Each rewind goes back to an older checkpoint, at least half the
+        # checkpoint interval back.
+        tick = self.simulation.ticks - self.snapshot_ticks // 2
+        snapshot = self.snapshots.latest(tick, safe=True)
+        if snapshot is not None:
+            self.restore(snapshot)
+
+    def restore(self, snapshot):
+        self.snapshots.restore(self.simulation, snapshot)
+        # Icarus gets the controls held now rather than then.
+        self.icarus.set_keys(self.held_controls)
+        self.time = self.simulation.time
+        self.step_wall_time = timer()
+        if self.losing:
+            self.losing = False
+            pyglet.clock.unschedule(self.lose)
+            self.fade(tone=0, alpha=0)
+
     def win(self, dt):
         self.delete()
 
-    def step_clouds(self, dt):
-        self.delete_clouds()
-        self.create_clouds()
-
-    def delete_clouds(self):
-        clouds = [c for c in self.clouds
-                  if abs(c.body.position.x) > config.cloud_max_x]
-        for cloud in clouds:
-            self.clouds.remove(cloud)
-            cloud.delete()
-
-    def create_clouds(self, init=False):
-        while len(self.clouds) < config.cloud_count:
-            side = random.choice([-1, 1])
-            if init:
-                x = random.uniform(-config.cloud_max_x, config.cloud_max_x)
-            else:
-                x = config.cloud_max_x * side
-            y = random.uniform(config.cloud_min_y, config.cloud_max_y)
-            dx = -side * random.uniform(config.cloud_min_dx,
-                                        config.cloud_max_dx)
-            cloud = Cloud(self, position=(x, y), linear_velocity=(dx, 0))
-            self.clouds.append(cloud)
-
     def step_fade(self, dt):
         self.fade_tone = clamp(self.fade_tone, 0, 1)
         self.fade_alpha = clamp(self.fade_alpha, 0, 1)
         self.fade_tone += self.fade_delta_tone * dt
         self.fade_alpha += self.fade_delta_alpha * dt
 
-    def init_world(self):
-        aabb = b2.b2AABB()
-        aabb.lowerBound = -100, -10
-        aabb.upperBound = 100, 100
-        self.world = b2.b2World(aabb, (0, -config.gravity), True)
-
     def on_draw(self):
+        profiler = self.profiler
+        profiler.start('draw')
+        self.render_stats.reset()
         red, green, blue = config.sky_color
         glClearColor(red, green, blue, 0)
         self.window.clear()
@@ -506,26 +279,185 @@ class GameScreen(Screen):
         glTranslatef(self.window.width // 2, self.window.height // 2, 0)
         scale = self.window.height / 15
         glScalef(scale, scale, scale)
-        camera_position = (self.icarus.body.position +
+        self.alpha = self.get_alpha()
+        icarus_x, icarus_y, _ = self.icarus.get_interpolated_state(self.alpha)
+        camera_position = (b2.b2Vec2(icarus_x, icarus_y) +
                            b2.b2Vec2(*config.camera_offset))
         camera_position.y = clamp(camera_position.y, config.camera_min_y,
                                   config.camera_max_y)
         glTranslatef(-camera_position.x, -camera_position.y, 0)
-        for cloud in self.clouds:
-            cloud.draw_shadow()
+        lower, upper = self.get_view_rect(camera_position, scale)
+        profiler.start('shadows')
+        self.draw_cloud_shadows(lower, upper)
+        profiler.stop('shadows')
         self.draw_sea()
-        self.island.draw()
-        self.pearly_gates.render()
-        rabbyt.render_unsorted(self.temples)
-        self.icarus.draw()
-        for cloud in self.clouds:
-            cloud.draw()
+        profiler.start('sprites')
+        self.island_batch.draw(self.render_stats)
+        self.draw_temples(lower, upper)
+        self.draw_icarus()
+        self.draw_clouds(lower, upper)
+        profiler.stop('sprites')
+        if self.show_static_map:
+            self.draw_static_map(lower, upper)
         glPopMatrix()
         self.draw_fade()
+        profiler.stop('draw')
+        profiler.end_frame()
+        self.measure_input_latency()
         if config.fps:
             self.clock_display.draw()
+            self.draw_stats()
+        if self.show_profile:
+            self.draw_profile()
+        self.capture_frame()
         return pyglet.event.EVENT_HANDLED
 
+    def capture_frame(self):
+        # Screenshots and recorded frames are read back at the end of a
+        # frame and written to disk by the capture's worker thread.
+        self.capture.update()
+        if self.screenshot_requested:
+            self.screenshot_requested = False
+            self.capture.capture(config.screenshot, 'png')
+        if (self.recording_frames and
+            not self.capture.frame_number % config.capture_interval):
+            format = config.capture_format
+            if format == 'raw':
+                name = 'frame-%06d-%dx%d.rgba' % (self.recorded_frames,
+                                                  self.window.width,
+                                                  self.window.height)
+            else:
+                name = 'frame-%06d.png' % self.recorded_frames
+            self.capture.capture(os.path.join(config.capture_dir, name),
+                                 format)
+            self.recorded_frames += 1
+
+    def toggle_frame_recording(self):
+        if not self.recording_frames and not os.path.isdir(config.capture_dir):
+            os.makedirs(config.capture_dir)
+        self.recording_frames = not self.recording_frames
+
+    def measure_input_latency(self):
+        # From each key press to the end of the first frame drawn after the
+        # tick that applied it.
+        applied = self.simulation.input_queue.applied
+        if applied:
+            now = timer()
+            for wall_time in applied:
+                self.input_latency.add(now - wall_time)
+            del applied[:]
+
+    def get_view_rect(self, camera_position, scale):
+        # The world rectangle that the camera shows.
+        half_width = self.window.width / scale / 2
+        half_height = self.window.height / scale / 2
+        return ((camera_position.x - half_width,
+                 camera_position.y - half_height),
+                (camera_position.x + half_width,
+                 camera_position.y + half_height))
+
+    def get_clouds(self, lower, upper, margin):
+        # The clouds near the rectangle, with their field slots and
+        # positions as arrays.
+        (min_x, min_y), (max_x, max_y) = lower, upper
+        clouds = self.simulation.clouds.query((min_x - margin, min_y - margin),
+                                              (max_x + margin, max_y + margin))
+        slots = numpy.array([cloud.field_slot for cloud in clouds],
+                            dtype=int)
+        field = self.simulation.cloud_field
+        positions = field.positions[slots]
+        # Drifting clouds move at a constant speed, so their position between
+        # the last two ticks follows from their velocity.
+        positions[:, 0] -= (field.dxs[slots] * (1 - self.alpha) *
+                            self.simulation.dt)
+        return clouds, slots, positions
+
+    def draw_stats(self):
+        culled = ', '.join('%s %d' % item for item in
+                           sorted(self.render_stats.culled.items()))
+        self.stats_label.text = ('draw calls: %d, vertices: %d, culled: %s, '
+                                 'substeps: %d, dropped: %.0f ms, '
+                                 'input latency: %.1f ms' %
+                                 (self.render_stats.draw_calls,
+                                  self.render_stats.vertices, culled,
+                                  self.substeps, self.dropped_time * 1000,
+                                  self.input_latency.percentile(50) * 1000))
+        self.stats_label.y = self.window.height - 20
+        self.stats_label.draw()
+
+    def draw_profile(self):
+        # Sorting the samples every frame would show up in the profile, so
+        # the percentiles are refreshed a few times a second.
+        if not self.profile_label.text or not self.profiler.frame_number % 30:
+            lines = self.profiler.report()
+            lines.append(self.input_latency.report('input'))
+            lines.append(self.snapshots.report())
+            lines.append(self.capture.report())
+            self.profile_label.text = '\n'.join(lines)
+        self.profile_label.y = self.window.height - 40
+        self.profile_label.draw()
+
+    def draw_icarus(self):
+        icarus = self.icarus
+        if icarus.state in ('standing', 'walking'):
+            sprite = self.walking_sprite
+        else:
+            sprite = self.flying_sprite
+        x, y, angle = icarus.get_interpolated_state(self.alpha)
+        sprite.xy = x, y
+        sprite.rot = angle * 180 / pi
+        sprite.scale_x = icarus.facing * abs(sprite.scale_x)
+        sprite.green = 1 - clamp(icarus.damage, 0, 1)
+        sprite.blue = 1 - clamp(icarus.damage, 0, 1)
+        sprite.render()
+        self.render_stats.add(4)
+
+    def draw_temples(self, lower, upper):
+        # Temples are drawn straight from the level's chunks, whether or not
+        # their bodies have been streamed in. The pearly gates are a golden
+        # temple.
+        level = self.simulation.level
+        (min_x, min_y), (max_x, max_y) = lower, upper
+        half_width, half_height = self.temple_batch.half_size
+        temples = level.temples_in((min_x - half_width, min_y - half_height),
+                                   (max_x + half_width, max_y + half_height))
+        positions = numpy.vstack(([level.pearly_gates], temples))
+        colors = numpy.ones((len(positions), 4))
+        colors[0, 2] = 0
+        culled = self.temple_batch.update(positions, colors, lower, upper)
+        culled += len(level.temples) - len(temples)
+        self.render_stats.cull('temples', culled)
+        self.temple_batch.draw(self.render_stats)
+
+    def draw_cloud_shadows(self, lower, upper):
+        # A shadow reaches at most shadow_length from its cloud.
+        clouds, slots, positions = self.get_clouds(lower, upper,
+                                                   config.shadow_length)
+        quads = self.simulation.cloud_field.shadow_quads(
+            slots, self.simulation.sun, positions)
+        culled = self.shadow_batch.update(quads, lower, upper)
+        culled += len(self.simulation.clouds) - len(clouds)
+        self.render_stats.cull('shadows', culled)
+        self.shadow_batch.draw(self.render_stats)
+
+    def draw_clouds(self, lower, upper):
+        clouds, _, positions = self.get_clouds(
+            lower, upper, max(self.cloud_batch.half_size))
+        culled = self.cloud_batch.update(positions, None, lower, upper)
+        culled += len(self.simulation.clouds) - len(clouds)
+        self.render_stats.cull('clouds', culled)
+        self.cloud_batch.draw(self.render_stats)
+
+    def draw_static_map(self, lower, upper):
+        static_map = self.simulation.static_map
+        if static_map is None:
+            return
+        if self.heatmap_batch is None:
+            self.heatmap_batch = HeatmapBatch(static_map)
+        culled = self.heatmap_batch.update(lower, upper)
+        self.render_stats.cull('heatmap', culled)
+        self.heatmap_batch.draw(self.render_stats)
+
     def draw_sea(self):
         glBindTexture(GL_TEXTURE_2D, 0)
         glColor3f(*config.sea_color)
@@ -535,6 +467,7 @@ class GameScreen(Screen):
         glVertex2f(1000, -1000)
         glVertex2f(-1000, -1000)
         glEnd()
+        self.render_stats.add(4)
 
     def fade(self, tone, alpha):
         if self.fade_alpha <= 0:
@@ -555,28 +488,104 @@ class GameScreen(Screen):
             glVertex2f(self.window.width, self.window.height)
             glVertex2f(0, self.window.height)
             glEnd()
+            self.render_stats.add(4)
 
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.ESCAPE:
             self.delete()
         elif symbol == pyglet.window.key.F12:
-            save_screenshot('pycarus-screenshot.png')
-        else:
-            self.icarus.on_key_press(symbol, modifiers)
+            self.screenshot_requested = True
+        elif symbol == pyglet.window.key.F11:
+            self.toggle_frame_recording()
+        elif symbol == pyglet.window.key.F9:
+            self.show_profile = not self.show_profile
+        elif (symbol == pyglet.window.key.BACKSPACE and not self.replaying and
+              not self.winning):
+            self.rewind()
+        elif symbol == pyglet.window.key.F8:
+            self.show_static_map = not self.show_static_map
+        elif symbol == pyglet.window.key.F10:
+            self.profiler.dump('pycarus-profile.csv')
+        elif symbol in self.key_controls and not self.replaying:
+            self.push_input(self.key_controls[symbol], True)
         return pyglet.event.EVENT_HANDLED
 
     def on_key_release(self, symbol, modifiers):
-        self.icarus.on_key_release(symbol, modifiers)
+        if symbol in self.key_controls and not self.replaying:
+            self.push_input(self.key_controls[symbol], False)
         return pyglet.event.EVENT_HANDLED
 
+    def push_input(self, control, pressed):
+        # Stamp the event with the game time it happened at: the clock as of
+        # the last step plus the wall time since.
+        if pressed:
+            self.held_controls.add(control)
+        else:
+            self.held_controls.discard(control)
+        wall_time = timer()
+        time = self.time + (wall_time - self.step_wall_time)
+        self.simulation.input_queue.push(time, control, pressed, wall_time)
+
+def parse_args(args):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--seed', type='int', help='random seed')
+    parser.add_option('--record', metavar='FILE',
+                      help='record each game to a replay file')
+    parser.add_option('--replay', metavar='FILE',
+                      help='play back a recorded game')
+    parser.add_option('--no-sound', action='store_true',
+                      help='turn off sound')
+    parser.add_option('--level', metavar='FILE', help='level file to load')
+    parser.add_option('--profile', action='store_true',
+                      help='show the frame profiler overlay')
+    parser.add_option('--profile-csv', metavar='FILE',
+                      help='write per-frame profiler samples to a CSV file')
+    parser.add_option('--static-map', action='store_true',
+                      help='show the static shade and ground overlay')
+    parser.add_option('--capture-frames', metavar='DIR',
+                      help='record every Nth frame to a directory')
+    parser.add_option('--capture-interval', type='int', metavar='N',
+                      help='frames between recorded frames')
+    parser.add_option('--capture-format', choices=['raw', 'png'],
+                      help='format of recorded frames: raw or png')
+    return parser.parse_args(args)
+
 def main():
+    options, _ = parse_args(sys.argv[1:])
+    config.seed = options.seed
+    config.record = options.record
+    config.replay = options.replay
+    if options.level:
+        config.level = options.level
+    if options.no_sound:
+        config.sound = False
+    if options.profile:
+        config.profile = True
+    config.profile_csv = options.profile_csv
+    if options.static_map:
+        config.show_static_map = True
+    if options.capture_frames:
+        config.capture_frames = True
+        config.capture_dir = options.capture_frames
+    if options.capture_interval:
+        config.capture_interval = options.capture_interval
+    if options.capture_format:
+        config.capture_format = options.capture_format
     window = pyglet.window.Window(fullscreen=config.fullscreen)
     window.set_exclusive_mouse(config.fullscreen)
     window.set_exclusive_keyboard(config.fullscreen)
     rabbyt.set_default_attribs()
     pyglet.resource.path = ['@pycarus']
-    TitleScreen(window)
+    if config.texture_atlas:
+        assets.pack(packed_images)
+    if config.sound:
+        mixer = Mixer(config.voice_count, config.channel_volumes)
+    else:
+        mixer = None
+    TitleScreen(window, SoundEffects(mixer))
     pyglet.app.run()
+    if config.asset_stats:
+        sys.stdout.write(assets.report() + '\n')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,136 @@
+from __future__ import division
+
+from assets import assets
+import config
+from profiler import timer
+
+import pyglet
+import pyglet.media
+
+class Voice(object):
+    # One pooled player. A player that played a sound before keeps it
+    # queued, so playing the same sound again only rewinds it.
+    def __init__(self):
+        self.player = None
+        self.source = None
+        self.name = None
+        self.channel = None
+        self.priority = 0
+        self.volume = 1
+        self.looping = False
+        self.start_time = 0
+        self.end_time = 0
+
+    def busy(self, time):
+        return self.name is not None and (self.looping or time < self.end_time)
+
+    def start(self, source, name, channel, priority, volume, looping, time):
+        if self.player is None:
+            self.player = pyglet.media.Player()
+        player = self.player
+        player.pause()
+        if self.source is not source:
+            if self.source is not None:
+                player.next()
+            player.queue(source)
+            self.source = source
+        if looping:
+            player.eos_action = player.EOS_LOOP
+        else:
+            player.eos_action = player.EOS_PAUSE
+        self.name = name
+        self.channel = channel
+        self.priority = priority
+        self.volume = volume
+        self.looping = looping
+        self.start_time = time
+        self.end_time = time + (source.duration or 0)
+        player.seek(0)
+        player.play()
+
+    def stop(self):
+        if self.player is not None:
+            self.player.pause()
+        self.name = None
+        self.looping = False
+
+class Mixer(object):
+    # A fixed number of voices. A sound takes a free voice, or else steals
+    # the voice playing the lowest priority sound, the oldest one first, if
+    # that is no higher than its own; if not, the sound is dropped. Each
+    # voice's volume is the sound's volume times those of its channel and
+    # the master channel.
+    def __init__(self, voice_count, channel_volumes):
+        self.voices = [Voice() for _ in range(voice_count)]
+        self.channel_volumes = dict(channel_volumes)
+        self.loops = {}
+        self.plays = 0
+        self.steals = 0
+        self.drops = 0
+
+    def play(self, name, channel, priority=0, volume=1):
+        self.start(name, channel, priority, volume, False)
+
+    def loop(self, name, channel, priority=0, volume=1):
+        voice = self.loops.get(name)
+        if voice is not None and voice.name == name and voice.looping:
+            voice.start(voice.source, name, channel, priority, volume, True,
+                        timer())
+            self.apply_volume(voice)
+        else:
+            self.loops[name] = self.start(name, channel, priority, volume,
+                                          True)
+
+    def stop(self, name):
+        voice = self.loops.pop(name, None)
+        if voice is not None and voice.name == name and voice.looping:
+            voice.stop()
+
+    def start(self, name, channel, priority, volume, looping):
+        time = timer()
+        voice = self.acquire(priority, time)
+        if voice is None:
+            self.drops += 1
+            return None
+        if name in config.streamed_sounds:
+            source = assets.stream(name)
+        else:
+            source = assets.sound(name)
+        voice.start(source, name, channel, priority, volume, looping, time)
+        self.apply_volume(voice)
+        self.plays += 1
+        return voice
+
+    def acquire(self, priority, time):
+        victim = None
+        for voice in self.voices:
+            if not voice.busy(time):
+                return voice
+            if voice.priority <= priority and (
+                victim is None or (voice.priority, voice.start_time) <
+                (victim.priority, victim.start_time)):
+                victim = voice
+        if victim is not None:
+            victim.stop()
+            self.steals += 1
+        return victim
+
+    def set_volume(self, channel, volume):
+        self.channel_volumes[channel] = volume
+        for voice in self.voices:
+            if voice.name is not None:
+                self.apply_volume(voice)
+
+    def apply_volume(self, voice):
+        voice.player.volume = (voice.volume *
+                               self.channel_volumes.get(voice.channel, 1) *
+                               self.channel_volumes.get('master', 1))
+
+    def busy_count(self):
+        time = timer()
+        return sum(1 for voice in self.voices if voice.busy(time))
+
+    def pause_all(self):
+        for voice in self.voices:
+            voice.stop()
+        self.loops.clear()
@@ -0,0 +1,87 @@
+from __future__ import division
+
+from collections import deque
+from math import *
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+class Profiler(object):
+    # Scoped timers that add up per frame. The last frames are kept for
+    # rolling percentiles and for dumping to CSV.
+    def __init__(self, frame_count=600):
+        self.stages = []
+        self.starts = {}
+        self.frame = {}
+        self.frames = deque(maxlen=frame_count)
+        self.frame_number = 0
+
+    def start(self, stage):
+        self.starts[stage] = timer()
+
+    def stop(self, stage):
+        elapsed = timer() - self.starts[stage]
+        if stage not in self.frame:
+            if stage not in self.stages:
+                self.stages.append(stage)
+            self.frame[stage] = elapsed
+        else:
+            self.frame[stage] += elapsed
+
+    def end_frame(self):
+        self.frame_number += 1
+        self.frames.append((self.frame_number, self.frame))
+        self.frame = {}
+
+    def percentile(self, stage, percent):
+        return percentile([frame.get(stage, 0) for _, frame in self.frames],
+                          percent)
+
+    def report(self):
+        lines = ['%-10s %8s %8s %8s' % ('stage', 'p50 ms', 'p95 ms',
+                                         'p99 ms')]
+        for stage in self.stages:
+            lines.append('%-10s %8.2f %8.2f %8.2f' %
+                         ((stage,) + tuple(self.percentile(stage, percent) *
+                                           1000
+                                           for percent in (50, 95, 99))))
+        return lines
+
+    def dump(self, path):
+        out = open(path, 'w')
+        try:
+            out.write(','.join(['frame'] + self.stages) + '\n')
+            for frame_number, frame in self.frames:
+                out.write(','.join([str(frame_number)] +
+                                   ['%.6f' % frame.get(stage, 0)
+                                    for stage in self.stages]) + '\n')
+        finally:
+            out.close()
+
+class LatencyMeter(object):
+    # The last latencies measured, in seconds, for rolling percentiles.
+    def __init__(self, sample_count=100):
+        self.samples = deque(maxlen=sample_count)
+        self.count = 0
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self.count += 1
+
+    def percentile(self, percent):
+        return percentile(self.samples, percent)
+
+    def report(self, name):
+        # A line in the same columns as Profiler.report.
+        return '%-10s %8.2f %8.2f %8.2f' % ((name,) + tuple(
+            self.percentile(percent) * 1000 for percent in (50, 95, 99)))
+
+def percentile(samples, percent):
+    samples = sorted(samples)
+    if not samples:
+        return 0
+    rank = int(ceil(percent / 100 * len(samples))) - 1
+    return samples[clamp_rank(rank, len(samples))]
+
+def clamp_rank(rank, count):
+    return max(0, min(count - 1, rank))
@@ -0,0 +1,131 @@
+from __future__ import division
+
+import ctypes
+import numpy
+import pyglet
+from pyglet.gl import *
+
+class RenderStats(object):
+    def __init__(self):
+        self.draw_calls = 0
+        self.vertices = 0
+        self.culled = {}
+
+    def reset(self):
+        self.draw_calls = 0
+        self.vertices = 0
+        self.culled = {}
+
+    def add(self, vertices, draw_calls=1):
+        self.draw_calls += draw_calls
+        self.vertices += vertices
+
+    def cull(self, kind, count):
+        self.culled[kind] = self.culled.get(kind, 0) + count
+
+def overlaps(quads, lower, upper):
+    # Mask of the quads in an (n, 8) array whose bounds overlap the
+    # rectangle from lower to upper.
+    xs = quads[:, 0::2]
+    ys = quads[:, 1::2]
+    return ((xs.max(axis=1) >= lower[0]) & (xs.min(axis=1) <= upper[0]) &
+            (ys.max(axis=1) >= lower[1]) & (ys.min(axis=1) <= upper[1]))
+
+def copy_array(target, array):
+    array = numpy.ascontiguousarray(array, dtype=numpy.float32)
+    ctypes.memmove(target, array.ctypes.data, array.nbytes)
+
+class QuadBatch(object):
+    # Quads in one vertex list, drawn with a single call. The list only
+    # grows; quads past the current count are collapsed to a point so they
+    # draw nothing.
+    formats = ('v2f/stream', 'c4f/static')
+
+    def __init__(self):
+        self.vertex_list = None
+        self.capacity = 0
+        self.count = 0
+
+    def delete(self):
+        if self.vertex_list is not None:
+            self.vertex_list.delete()
+            self.vertex_list = None
+
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        capacity = max(count, 2 * self.capacity, 16)
+        if self.vertex_list is None:
+            self.vertex_list = pyglet.graphics.vertex_list(4 * capacity,
+                                                           *self.formats)
+        else:
+            self.vertex_list.resize(4 * capacity)
+        self.capacity = capacity
+        self.count = capacity
+        self.init_quads()
+
+    def init_quads(self):
+        pass
+
+    def set_quads(self, quads):
+        count = len(quads)
+        self.reserve(count)
+        if self.vertex_list is None:
+            return
+        vertices = numpy.zeros((max(count, self.count), 8),
+                               dtype=numpy.float32)
+        vertices[:count] = quads
+        copy_array(self.vertex_list.vertices, vertices)
+        self.count = count
+
+    def bind(self):
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def draw(self, stats=None):
+        if not self.count:
+            return
+        self.bind()
+        self.vertex_list.draw(GL_QUADS)
+        if stats is not None:
+            stats.add(4 * self.capacity)
+
+class SpriteBatch(QuadBatch):
+    # Unrotated copies of one texture, moved in bulk from an array of
+    # positions.
+    formats = ('v2f/stream', 't3f/static', 'c4f/static')
+
+    def __init__(self, texture, scale=1):
+        super(SpriteBatch, self).__init__()
+        self.texture = texture
+        half_width = texture.width * scale / 2
+        half_height = texture.height * scale / 2
+        self.half_size = half_width, half_height
+        self.offsets = numpy.array([-half_width, -half_height,
+                                    half_width, -half_height,
+                                    half_width, half_height,
+                                    -half_width, half_height])
+
+    def init_quads(self):
+        tex_coords = numpy.tile(numpy.array(self.texture.tex_coords),
+                                self.capacity)
+        copy_array(self.vertex_list.tex_coords, tex_coords)
+        copy_array(self.vertex_list.colors, numpy.ones(16 * self.capacity))
+
+    def update(self, positions, colors=None, lower=None, upper=None):
+        # Positions outside the rectangle from lower to upper are culled.
+        # Returns the number of culled sprites.
+        quads = numpy.tile(positions, 4) + self.offsets
+        culled = 0
+        if lower is not None:
+            visible = overlaps(quads, lower, upper)
+            quads = quads[visible]
+            if colors is not None:
+                colors = colors[visible]
+            culled = len(visible) - len(quads)
+        self.set_quads(quads)
+        if colors is not None and len(colors):
+            copy_array(self.vertex_list.colors, numpy.repeat(colors, 4, axis=0))
+        return culled
+
+    def bind(self):
+        glBindTexture(self.texture.target, self.texture.id)
@@ -0,0 +1,83 @@
+from simulation import UP, LEFT, RIGHT
+
+control_names = {'up': UP, 'left': LEFT, 'right': RIGHT}
+
+def encode_keys(keys):
+    mask = 0
+    for control in keys:
+        mask |= control
+    return mask
+
+def decode_keys(mask):
+    return set(control for control in (UP, LEFT, RIGHT) if mask & control)
+
+class Script(object):
+    # Scripted input: each line holds a tick number followed by the controls
+    # held from that tick on, for example "120 up right". A dash releases
+    # everything.
+    def __init__(self, changes=()):
+        self.changes = dict(changes)
+
+    def __call__(self, tick):
+        return self.changes.get(tick)
+
+    @classmethod
+    def load(cls, path):
+        changes = []
+        for line in open(path):
+            words = line.split('#')[0].split()
+            if not words:
+                continue
+            tick = int(words[0])
+            keys = set(control_names[word] for word in words[1:]
+                       if word != '-')
+            changes.append((tick, keys))
+        return cls(changes)
+
+class Recording(object):
+    # The seed plus the key state of every tick, run-length encoded so that
+    # only the ticks where the state changes are stored.
+    version = 1
+
+    def __init__(self, seed, changes=None, ticks=0):
+        self.seed = seed
+        self.changes = changes or []
+        self.ticks = ticks
+
+    def record(self, tick, keys):
+        mask = encode_keys(keys)
+        if not self.changes or self.changes[-1][1] != mask:
+            self.changes.append((tick, mask))
+        self.ticks = tick + 1
+
+    def rewind(self, change_count, ticks):
+        # Forget what was recorded after a restored snapshot.
+        del self.changes[change_count:]
+        self.ticks = ticks
+
+    def script(self):
+        return Script((tick, decode_keys(mask))
+                      for tick, mask in self.changes)
+
+    def save(self, path):
+        out = open(path, 'w')
+        try:
+            out.write('pycarus-replay %d\n' % self.version)
+            out.write('seed %d\n' % self.seed)
+            out.write('ticks %d\n' % self.ticks)
+            for tick, mask in self.changes:
+                out.write('%d %d\n' % (tick, mask))
+        finally:
+            out.close()
+
+    @classmethod
+    def load(cls, path):
+        lines = open(path).read().split('\n')
+        magic, version = lines[0].split()
+        if magic != 'pycarus-replay' or int(version) != cls.version:
+            raise ValueError('%s is not a pycarus replay' % path)
+        seed = int(lines[1].split()[1])
+        ticks = int(lines[2].split()[1])
+        changes = [tuple(int(word) for word in line.split())
+                   for line in lines[3:] if line.strip()]
+        return cls(seed, changes, ticks)
@@ -1,69 +1,69 @@
-import pyglet
-import pyglet.media
-
-wingflap = pyglet.media.StaticSource(pyglet.resource.media('sounds/flap.wav'))
-level_start = pyglet.media.StaticSource(pyglet.resource.media('sounds/level_start.wav'))
-level_win = pyglet.media.StaticSource(pyglet.resource.media('sounds/level_win.wav'))
-
-walk_sound = pyglet.media.StaticSource(pyglet.resource.media('sounds/step.wav'))
-walk_player = pyglet.media.Player()
-walk_player.queue(walk_sound)
-walk_player.volume = 0.5
-
-heart = pyglet.media.StaticSource(pyglet.resource.media('sounds/heartbeat.wav'))
-heart_player = pyglet.media.Player()
-heart_player.queue(heart)
-
-sizzle_sound = pyglet.media.StaticSource(pyglet.resource.media('sounds/sizzle.wav'))
-sizzle_player = pyglet.media.Player()
-sizzle_player.queue(sizzle_sound)
-sizzle_player.volume = 0.3
-
-wind = pyglet.media.StaticSource(pyglet.resource.media('sounds/wind.wav'))
-wind_player = pyglet.media.Player()
-wind_player.queue(wind)wind_player.volume = 0.5
-
-players = []
-
-def flap():
-	player = wingflap.play()
-	players.append(player)
-def start():
-	player = level_start.play()
-	players.append(player)
-def win():
-	player = level_win.play()
-	players.append(player)
-
-def walk():
-    walk_player.eos_action = walk_player.EOS_LOOP
-    walk_player.play()
-    walk_player.seek(0)
-def walk_stop():
-    walk_player.pause()
-def heartbeat():
-    heart_player.eos_action = walk_player.EOS_LOOP
-    heart_player.play()
-    heart_player.seek(0)
-def heartbeat_stop():
-    heart_player.pause()
-def sizzle():
-    sizzle_player.eos_action = walk_player.EOS_LOOP
-    sizzle_player.play()
-    sizzle_player.seek(0)
-def sizzle_stop():
-    sizzle_player.pause()
-def wind():
-    wind_player.eos_action = walk_player.EOS_LOOP
-    wind_player.play()
-    wind_player.seek(0)
-def wind_stop():
-    wind_player.pause()
-
-def pause_all():
-    walk_player.pause()
-    heart_player.pause()
-    sizzle_player.pause()
-    wind_player.pause()
-    for player in players:
-        player.pause()
+sounds = [
+    'sounds/flap.wav',
+    'sounds/level_start.wav',
+    'sounds/level_win.wav',
+    'sounds/step.wav',
+    'sounds/heartbeat.wav',
+    'sounds/sizzle.wav',
+    'sounds/wind.wav',
+]
+
+class NullMixer(object):
+    # Plays nothing. Used when sound is off and for headless runs.
+    def play(self, name, channel, priority=0, volume=1):
+        pass
+
+    def loop(self, name, channel, priority=0, volume=1):
+        pass
+
+    def stop(self, name):
+        pass
+
+    def set_volume(self, channel, volume):
+        pass
+
+    def pause_all(self):
+        pass
+
+class SoundEffects(object):
+    # The game's sounds, with the channel and priority of each. Jingles win
+    # over heartbeats and sizzles, which win over flaps and the wind, which
+    # win over footsteps.
+    def __init__(self, mixer=None):
+        self.mixer = mixer or NullMixer()
+
+    def flap(self):
+        self.mixer.play('sounds/flap.wav', 'effects', 1)
+
+    def start(self):
+        self.mixer.play('sounds/level_start.wav', 'jingles', 3)
+
+    def win(self):
+        self.mixer.play('sounds/level_win.wav', 'jingles', 3)
+
+    def walk(self):
+        self.mixer.loop('sounds/step.wav', 'effects', 0, 0.5)
+
+    def walk_stop(self):
+        self.mixer.stop('sounds/step.wav')
+
+    def heartbeat(self):
+        self.mixer.loop('sounds/heartbeat.wav', 'effects', 2)
+
+    def heartbeat_stop(self):
+        self.mixer.stop('sounds/heartbeat.wav')
+
+    def sizzle(self):
+        self.mixer.loop('sounds/sizzle.wav', 'effects', 2, 0.3)
+
+    def sizzle_stop(self):
+        self.mixer.stop('sounds/sizzle.wav')
+
+    def wind(self):
+        self.mixer.loop('sounds/wind.wav', 'ambience', 1, 0.5)
+
+    def wind_stop(self):
+        self.mixer.stop('sounds/wind.wav')
+
+    def pause_all(self):
+        self.mixer.pause_all()
@@ -0,0 +1,26 @@
+from __future__ import division
+
+import config
+from render import QuadBatch, copy_array, overlaps
+
+import numpy
+
+class ShadowBatch(QuadBatch):
+    # Draws the shadow quads that CloudField.shadow_quads keeps.
+    def init_quads(self):
+        red, green, blue = config.shadow_color
+        quad_colors = numpy.array([red, green, blue, 1] * 2 +
+                                  [red, green, blue, 0] * 2)
+        copy_array(self.vertex_list.colors,
+                   numpy.tile(quad_colors, self.capacity))
+
+    def update(self, quads, lower=None, upper=None):
+        # Shadows outside the rectangle from lower to upper are culled.
+        # Returns the number of culled shadows.
+        culled = 0
+        if lower is not None:
+            visible = overlaps(quads, lower, upper)
+            quads = quads[visible]
+            culled = len(visible) - len(quads)
+        self.set_quads(quads)
+        return culled
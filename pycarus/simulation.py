@@ -0,0 +1,741 @@
+from __future__ import division
+
+import b2
+from cloudfield import CloudField
+from cloudindex import CloudIndex
+import config
+from inputqueue import InputQueue
+from level import Level
+from profiler import Profiler
+from sfx import SoundEffects
+from staticmap import StaticMap
+from streaming import ChunkStreamer
+
+from math import *
+import numpy
+import random
+
+UP = 1
+LEFT = 2
+RIGHT = 4
+
+def clamp(x, min_x, max_x):
+    return max(min_x, min(max_x, x))
+
+def normalize_signed_angle(angle):
+    while angle < -pi:
+        angle += 2 * pi
+    while angle >= pi:
+        angle -= 2 * pi
+    return angle
+
+def path_offset(path, time):
+    # Linear interpolation between keyframes of (time, dx, dy), starting
+    # over after the last one.
+    period = path[-1][0]
+    if period > 0:
+        time %= period
+    previous = path[0]
+    for keyframe in path:
+        if time <= keyframe[0]:
+            t1, x1, y1 = previous
+            t2, x2, y2 = keyframe
+            u = (time - t1) / (t2 - t1) if t2 > t1 else 1
+            return x1 + (x2 - x1) * u, y1 + (y2 - y1) * u
+        previous = keyframe
+    return path[-1][1], path[-1][2]
+
+class Actor(object):
+    # Actors are slotted, and those stepped every tick keep the vectors they
+    # need rather than allocating new ones.
+    __slots__ = ()
+
+    def step(self, dt):
+        pass
+
+class Sun(Actor):
+    # The sun follows a path of offsets from where the level puts it, if it
+    # has one. Shadows are cast from the shadow position, which only catches
+    # up with the sun when the sun has moved further than
+    # sun_shadow_threshold, so that the cached shadow geometry stays valid
+    # in between. The revision counts the moves.
+    __slots__ = ('simulation', 'origin', 'path', 'time', 'position',
+                 'shadow_position', 'shadow_revision')
+
+    def __init__(self, simulation, position=(0, 0), path=None):
+        self.simulation = simulation
+        self.origin = tuple(position)
+        self.path = path
+        self.time = 0
+        self.position = self.origin
+        self.shadow_position = self.origin
+        self.shadow_revision = 0
+        if path is not None:
+            self.update_position()
+
+    def step(self, dt):
+        if self.path is not None:
+            self.time += dt
+            self.update_position()
+
+    def update_position(self):
+        origin_x, origin_y = self.origin
+        dx, dy = path_offset(self.path, self.time)
+        x = origin_x + dx
+        y = origin_y + dy
+        self.position = x, y
+        shadow_x, shadow_y = self.shadow_position
+        if hypot(x - shadow_x, y - shadow_y) > config.sun_shadow_threshold:
+            self.shadow_position = x, y
+            self.shadow_revision += 1
+
+    def snapshot(self):
+        return self.time, self.position, self.shadow_position
+
+    def restore(self, snapshot):
+        self.time, self.position, self.shadow_position = snapshot
+        self.shadow_revision += 1
+
+class Icarus(Actor):
+    __slots__ = ('simulation', 'body', 'keys', 'up', 'left', 'right',
+                 'sun_distance', 'cloud_distance', 'damage', 'fatigue',
+                 'state', 'facing', 'immortal', 'melting', 'flapped',
+                 'flap_time', 'previous_state', 'force', 'ground_segment',
+                 'ground_end')
+
+    # What a snapshot holds besides the body and the controls.
+    snapshot_fields = ('sun_distance', 'cloud_distance', 'damage', 'fatigue',
+                       'state', 'facing', 'melting', 'flapped', 'flap_time')
+
+    def __init__(self, simulation, position=(0, 0)):
+        self.simulation = simulation
+        self.init_body(position)
+        self.keys = set()
+        self.up = False
+        self.left = False
+        self.right = False
+        self.force = b2.b2Vec2(0, 0)
+        self.ground_segment = b2.b2Segment()
+        self.ground_end = b2.b2Vec2(0, 0)
+        self.previous_state = [0, 0, 0]
+        self.sun_distance = 1000
+        self.cloud_distance = 1000
+
+        self.damage = 0
+        self.fatigue = 0
+        self.state = 'flying'
+        self.facing = 1
+        self.immortal = config.immortal
+        self.melting = False
+        self.flapped = False
+        self.flap_time = 0
+        self.save_state()
+
+    def init_body(self, position):
+        body_def = b2.b2BodyDef()
+        body_def.position = position
+        self.body = self.simulation.world.CreateBody(body_def)
+        self.body.userData = self
+        shape_def = b2.b2CircleDef()
+        shape_def.radius = 0.5
+        shape_def.density = 1
+        self.body.CreateShape(shape_def)
+        self.body.SetMassFromShapes()
+
+    def delete(self):
+        self.simulation.world.DestroyBody(self.body)
+
+    def save_state(self):
+        # Keep the previous pose for drawing in between ticks.
+        position = self.body.position
+        state = self.previous_state
+        state[0] = position.x
+        state[1] = position.y
+        state[2] = self.body.angle
+
+    def snapshot(self):
+        body = self.body
+        return (body.position.tuple(), body.angle,
+                body.linearVelocity.tuple(), body.angularVelocity,
+                body.IsSleeping(), tuple(sorted(self.keys)),
+                tuple(self.previous_state),
+                tuple(getattr(self, name) for name in self.snapshot_fields))
+
+    def restore(self, snapshot):
+        (position, angle, linear_velocity, angular_velocity, sleeping, keys,
+         previous_state, fields) = snapshot
+        old_state = self.state
+        melting = self.melting
+        self.body.SetXForm(b2.b2Vec2(*position), angle)
+        self.body.SetLinearVelocity(b2.b2Vec2(*linear_velocity))
+        self.body.SetAngularVelocity(angular_velocity)
+        if sleeping:
+            self.body.PutToSleep()
+        else:
+            self.body.WakeUp()
+        self.set_keys(keys)
+        self.previous_state[:] = previous_state
+        for name, value in zip(self.snapshot_fields, fields):
+            setattr(self, name, value)
+        # Start and stop the loops to match.
+        sound = self.simulation.sound
+        if self.melting and not melting:
+            sound.sizzle()
+        elif melting and not self.melting:
+            sound.sizzle_stop()
+        if self.state != old_state:
+            self.update_sound(old_state)
+
+    def get_interpolated_state(self, alpha):
+        x1, y1, angle1 = self.previous_state
+        position = self.body.position
+        angle2 = self.body.angle
+        return (x1 + (position.x - x1) * alpha,
+                y1 + (position.y - y1) * alpha,
+                angle1 + (angle2 - angle1) * alpha)
+
+    def step(self, dt):
+        self.save_state()
+        sound = self.simulation.sound
+        old_state = self.state
+        if self.cloud_distance > config.shadow_length and not self.immortal:
+            if not self.melting:
+                self.melting = True
+                sound.sizzle()
+            self.damage = (dt / self.sun_distance / config.melt_duration +
+                           clamp(self.damage, 0, 1))
+        else:
+            if self.melting:
+                self.melting = False
+                sound.sizzle_stop()
+        self.update_distances()
+        self.update_state()
+        if self.state == 'standing':
+            self.step_standing(dt)
+        elif self.state == 'walking':
+            self.step_walking(dt)
+        elif self.state == 'flying':
+            self.step_flying(dt)
+        elif self.state == 'falling':
+            self.step_falling(dt)
+        if self.state != old_state:
+            self.update_sound(old_state)
+        if self.flapped and self.simulation.time >= self.flap_time:
+            self.flapped = False
+        if self.state == 'flying' and not self.flapped:
+            sound.flap()
+            self.flapped = True
+            self.flap_time = self.simulation.time + 1
+
+    def update_sound(self, old_state):
+        sound = self.simulation.sound
+        if old_state == 'walking':
+            sound.walk_stop()
+        if self.state == 'walking':
+            sound.walk()
+
+    def update_distances(self):
+        self.update_sun_distance()
+        self.update_cloud_distance()
+
+    def update_sun_distance(self):
+        position = self.body.position
+        sun_x, sun_y = self.simulation.sun.position
+        self.sun_distance = hypot(position.x - sun_x, position.y - sun_y)
+
+    def update_cloud_distance(self):
+        # Shade is tested towards the sun's shadow position, the one the
+        # drawn shadows are cast from. While the sun stays put, the static
+        # clouds come from the static map's precomputed lists and only the
+        # drifting ones are raycast.
+        position = self.body.position
+        x = position.x
+        y = position.y
+        static_map = self.simulation.static_shade
+        fraction, cloud = self.simulation.clouds.raycast(
+            (x, y), self.simulation.sun.shadow_position,
+            static=static_map is None)
+        if static_map is not None:
+            static_fraction, index = static_map.raycast((x, y))
+            if index is not None and static_fraction <= fraction:
+                cloud_x, cloud_y, _, _ = static_map.box(index)
+                self.cloud_distance = hypot(x - cloud_x, y - cloud_y)
+                return
+        if cloud is not None:
+            cloud_x, cloud_y = self.simulation.cloud_field.positions[
+                cloud.field_slot]
+            self.cloud_distance = hypot(x - cloud_x, y - cloud_y)
+        else:
+            self.cloud_distance = 1000
+
+    def raycast_cloud_distance(self):
+        # The Box2D raycast that update_cloud_distance replaces, kept for
+        # checking and benchmarking the analytic version. It only sees the
+        # drifting clouds after cloud_field.sync_all().
+        segment = b2.b2Segment()
+        segment.p1 = self.body.position
+        segment.p2 = self.simulation.sun.shadow_position
+        _, _, shape = self.simulation.world.RaycastOne(segment, False, None)
+        if shape is not None and isinstance(shape.GetBody().userData, Cloud):
+            cloud_position = shape.GetBody().position
+            return (self.body.position - cloud_position).Length()
+        return 1000
+
+    def update_state(self):
+        if (not self.immortal and (self.damage >= 1 or self.fatigue >= 1) or
+            self.body.position.y <= 0):
+            self.state = 'falling'
+        elif self.up:
+            self.state = 'flying'
+        elif self.on_ground():
+            if self.state not in ('standing', 'walking'):
+                self.state = 'standing'
+        else:
+            self.state = 'flying'
+
+    def on_ground(self):
+        # Only static shapes are solid, so where the static map has no
+        # ground there is no need to raycast.
+        static_map = self.simulation.static_map
+        if static_map is not None:
+            position = self.body.position
+            if not static_map.has_ground((position.x, position.y)):
+                return False
+        return self.raycast_ground()
+
+    def raycast_ground(self):
+        # See if there's any ground beneath Icarus's feet.
+        position = self.body.position
+        segment = self.ground_segment
+        end = self.ground_end
+        end.x = position.x
+        end.y = position.y - 0.6
+        segment.p1 = position
+        segment.p2 = end
+        _, _, shape = self.simulation.world.RaycastOne(segment, False, None)
+        return shape is not None and not shape.isSensor
+
+    def step_standing(self, dt):
+        # Rest on the ground.
+        self.fatigue = clamp(self.fatigue, 0, 1) - dt / config.rest_duration
+
+        if self.left or self.right:
+            self.state = 'walking'
+        elif self.at_rest():
+            # Pushing the body would wake it up, so leave it be and let it
+            # fall asleep.
+            return
+        velocity = self.body.linearVelocity
+        force = self.force
+        force.x = -velocity.x
+        force.y = -velocity.y
+        self.body.ApplyForce(force, self.body.position)
+        torque = -(self.body.angle * config.icarus_angular_k +
+                   self.body.angularVelocity * config.icarus_angular_damping)
+        self.body.ApplyTorque(torque)
+
+    def at_rest(self):
+        # Still and upright enough that there's nothing to damp.
+        body = self.body
+        if body.IsSleeping():
+            return True
+        velocity = body.linearVelocity
+        tolerance = config.rest_linear_tolerance
+        return (velocity.x * velocity.x + velocity.y * velocity.y <
+                tolerance * tolerance and
+                abs(body.angularVelocity) < config.rest_angular_tolerance and
+                abs(body.angle) < config.rest_angle_tolerance)
+
+    def step_walking(self, dt):
+        # Rest on the ground.
+        self.fatigue = clamp(self.fatigue, 0, 1) - dt / config.rest_duration
+
+        left = self.left
+        right = self.right
+        if not left and not right:
+            self.state = 'standing'
+            return
+        if left ^ right:
+            self.facing = right - left
+        velocity = self.body.linearVelocity
+        force = self.force
+        force.x = (right - left) * 10 - velocity.x
+        force.y = -velocity.y
+        self.body.ApplyForce(force, self.body.position)
+        torque = -(self.body.angle * config.icarus_angular_k +
+                   self.body.angularVelocity * config.icarus_angular_damping)
+        self.body.ApplyTorque(torque)
+
+    def step_flying(self, dt):
+        up = self.up
+        left = self.left
+        right = self.right
+        if up or left or right:
+            # Grow tired from flapping those wings.
+            self.fatigue = (dt / config.flight_duration +
+                            clamp(self.fatigue, 0, 1))
+        if left ^ right:
+            self.facing = right - left
+
+        # Fatigue and damage affect flight capabilities.
+        fatigue_factor = 1 - 2 * clamp(self.fatigue - 0.5, 0, 0.5)
+        damage_factor = 1 - 2 * clamp(self.damage - 0.5, 0, 0.5)
+        lift_force = up * fatigue_factor * damage_factor * config.icarus_lift_force
+
+        side_force = (right - left) * config.icarus_side_force
+        velocity = self.body.linearVelocity
+        force = self.force
+        force.x = side_force - velocity.x * config.icarus_air_resistance
+        force.y = lift_force - velocity.y * config.icarus_air_resistance
+        self.body.ApplyForce(force, self.body.position)
+        torque = -(self.body.angle * config.icarus_angular_k +
+                   self.body.angularVelocity * config.icarus_angular_damping)
+        self.body.ApplyTorque(torque)
+
+    def step_falling(self, dt):
+        angle_error = normalize_signed_angle(pi - self.body.angle)
+        torque = (angle_error * config.icarus_angular_k -
+                  self.body.angularVelocity * config.icarus_angular_damping)
+        self.body.ApplyTorque(torque)
+
+    def press(self, control):
+        self.keys.add(control)
+        self.update_controls()
+
+    def release(self, control):
+        self.keys.discard(control)
+        self.update_controls()
+
+    def set_keys(self, keys):
+        self.keys.clear()
+        self.keys.update(keys)
+        self.update_controls()
+
+    def update_controls(self):
+        # The controls as flags, since they are checked several times a
+        # tick.
+        keys = self.keys
+        self.up = UP in keys
+        self.left = LEFT in keys
+        self.right = RIGHT in keys
+
+class Cloud(Actor):
+    # Every cloud body is static. The drifting ones are moved by the cloud
+    # field. The cloud field and index keep their bookkeeping in the last
+    # slots.
+    __slots__ = ('simulation', 'dx', 'body', 'field_slot', 'slot', 'cell',
+                 'event')
+
+    width = 4.5
+
+    def __init__(self, simulation, position=(0, 0), linear_velocity=(0, 0),
+                 sensor=True, static=False):
+        self.simulation = simulation
+        self.dx = 0 if static else linear_velocity[0]
+        self.init_body(position, sensor)
+
+    def init_body(self, position, sensor):
+        body_def = b2.b2BodyDef()
+        body_def.position = position
+        self.body = self.simulation.world.CreateBody(body_def)
+        self.body.userData = self
+        shape_def = b2.b2PolygonDef()
+        shape_def.SetAsBox(self.width / 2, config.cloud_height / 2)
+        shape_def.isSensor = sensor
+        self.body.CreateShape(shape_def)
+
+    def delete(self):
+        self.simulation.world.DestroyBody(self.body)
+
+    def reset(self, position, linear_velocity):
+        self.dx = linear_velocity[0]
+        self.body.SetXForm(b2.b2Vec2(*position), 0)
+
+    def park(self):
+        # Move the body below the sea, out of the way of raycasts.
+        x = self.body.position.x
+        self.body.SetXForm(b2.b2Vec2(x, config.cloud_park_y), 0)
+
+class CloudPool(object):
+    # Drifting clouds that have left the level are parked here and reused
+    # for new ones instead of destroying and recreating their bodies. Once
+    # clouds have started coming back, asking an empty pool is a miss.
+    def __init__(self, simulation, capacity):
+        self.simulation = simulation
+        self.capacity = capacity
+        self.clouds = []
+        self.allocations = 0
+        self.reuses = 0
+        self.misses = 0
+        self.releases = 0
+
+    def acquire(self, position, linear_velocity):
+        if self.clouds:
+            cloud = self.clouds.pop()
+            cloud.reset(position, linear_velocity)
+            self.reuses += 1
+        else:
+            if self.releases:
+                self.misses += 1
+            cloud = Cloud(self.simulation, position, linear_velocity)
+            self.allocations += 1
+        return cloud
+
+    def release(self, cloud):
+        self.releases += 1
+        if len(self.clouds) < self.capacity:
+            cloud.park()
+            self.clouds.append(cloud)
+        else:
+            cloud.delete()
+
+class Island(Actor):
+    __slots__ = ('simulation', 'body')
+
+    half_width = 3.5
+    half_height = 1
+
+    def __init__(self, simulation, position=(0, 0)):
+        self.simulation = simulation
+        self.init_body(position)
+
+    def init_body(self, position):
+        body_def = b2.b2BodyDef()
+        body_def.position = position
+        self.body = self.simulation.world.CreateBody(body_def)
+        shape_def = b2.b2PolygonDef()
+        shape_def.SetAsBox(self.half_width, self.half_height)
+        self.body.CreateShape(shape_def)
+
+    def delete(self):
+        self.simulation.world.DestroyBody(self.body)
+
+class Simulation(object):
+    # The game world without a window, GL or sound. GameScreen drives it in
+    # real time; headless.py steps it as fast as it can.
+    def __init__(self, sound=None, seed=None, level=None):
+        self.sound = sound or SoundEffects()
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.script = None
+        self.recording = None
+        self.dt = 1 / 60
+        self.time = 0
+        self.ticks = 0
+        self.input_queue = InputQueue(self.dt)
+        self.active_body_count = 0
+        self.simulated_bodies = 0
+        self.skipped_steps = 0
+        self.profiler = Profiler(config.profile_frames)
+        self.level = level or Level.load(config.level)
+        self.cloud_count = self.level.cloud_count
+        if config.cloud_count is not None:
+            self.cloud_count = config.cloud_count
+
+        self.cloud_field = CloudField()
+        self.clouds = CloudIndex(self.cloud_field, config.cloud_cell_size,
+                                 self.level.cloud_max_x,
+                                 self.level.cloud_max_dx, self.dt)
+        self.init_world()
+        self.cloud_pool = CloudPool(self, config.cloud_pool_capacity)
+        self.init_level()
+        self.icarus = Icarus(self, self.level.start)
+        # The actors with dynamic bodies. Every other body is static, and
+        # the world step only has to do something while one of these is
+        # awake.
+        self.dynamic_actors = [self.icarus]
+
+    def init_world(self):
+        aabb = b2.b2AABB()
+        aabb.lowerBound, aabb.upperBound = self.level.bounds
+        self.world = b2.b2World(aabb, (0, -config.gravity), True)
+
+    def init_level(self):
+        level = self.level
+        self.sun = Sun(self, level.sun, config.sun_path)
+        self.pearly_gates_position = level.pearly_gates
+        self.create_pearly_gates(self.pearly_gates_position)
+        # The streamed area has to cover the camera and the reach of the
+        # shadows above Icarus.
+        self.streamer = ChunkStreamer(self, config.stream_distance,
+                                      config.stream_urgent_distance,
+                                      config.stream_budget)
+        self.streamer.update(level.start, load_all=True)
+        self.island = Island(self, level.island)
+        self.static_map = None
+        if config.static_map:
+            self.static_map = self.create_static_map()
+        # The static map's shade lists hold for a sun that stays put.
+        self.static_shade = None
+        if self.sun.path is None:
+            self.static_shade = self.static_map
+        self.create_clouds(init=True)
+
+    def create_static_map(self):
+        # Every temple, static cloud and the pearly gates, streamed in or
+        # not, cast shade. Sensors don't hold Icarus up, so only the solid
+        # ones and the island count as ground. A moving sun leaves the map
+        # with ground only. The map is built once and then read from the
+        # level cache.
+        level = self.level
+        size = (Cloud.width / 2, config.cloud_height / 2)
+        temples = level.temples - (0, 1.5)
+        pearly_gates = numpy.array([level.pearly_gates]) - (0, 1.5)
+        solid = numpy.hstack((numpy.vstack((temples, pearly_gates)),
+                              numpy.tile(size, (len(temples) + 1, 1))))
+        sensors = numpy.hstack((level.clouds,
+                                numpy.tile(size, (len(level.clouds), 1))))
+        island = numpy.array([level.island + (Island.half_width,
+                                              Island.half_height)])
+        shade = numpy.vstack((solid, sensors))
+        if self.sun.path is not None:
+            shade = shade[:0]
+        return StaticMap.load(level.cache_dir, level.bounds, level.chunk_size,
+                              config.static_map_cell_size, level.sun, shade,
+                              config.shadow_length,
+                              numpy.vstack((solid, island)), 0.6)
+
+    def snapshot(self):
+        # Everything that changes as the game runs, as plain data that can
+        # be pickled. The level and the static map are left out, since they
+        # never change.
+        recording = self.recording
+        return {
+            'ticks': self.ticks,
+            'time': self.time,
+            'lost': self.lost(),
+            'random': self.random.getstate(),
+            'sun': self.sun.snapshot(),
+            'icarus': self.icarus.snapshot(),
+            'clouds': self.clouds.snapshot(),
+            'chunks': self.streamer.snapshot(),
+            'recording': (None if recording is None else
+                          len(recording.changes)),
+        }
+
+    def restore(self, snapshot):
+        # Put the world back as it was, reusing the bodies there are. The
+        # drifting clouds are taken out and put back where the snapshot has
+        # them, with the pool making up the difference in their number.
+        self.ticks = snapshot['ticks']
+        self.time = snapshot['time']
+        self.random.setstate(snapshot['random'])
+        self.sun.restore(snapshot['sun'])
+        self.streamer.restore(snapshot['chunks'])
+        spare = self.clouds.remove_drifting()
+        clouds = []
+        for x, y, dx, _, _, _ in snapshot['clouds'][1]:
+            if spare:
+                cloud = spare.pop()
+                cloud.reset((x, y), (dx, 0))
+            else:
+                cloud = self.cloud_pool.acquire((x, y), (dx, 0))
+            clouds.append(cloud)
+        for cloud in spare:
+            self.cloud_pool.release(cloud)
+        self.clouds.restore(snapshot['clouds'], clouds)
+        self.icarus.restore(snapshot['icarus'])
+        self.input_queue.clear()
+        if self.recording is not None and snapshot['recording'] is not None:
+            self.recording.rewind(snapshot['recording'], self.ticks)
+
+    def create_temple(self, position):
+        x, y = position
+        cloud = Cloud(self, (x, y - 1.5), sensor=False, static=True)
+        self.clouds.add(cloud)
+        return cloud
+
+    def create_static_cloud(self, position):
+        cloud = Cloud(self, position, static=True)
+        self.clouds.add(cloud)
+        return cloud
+
+    def delete_static_cloud(self, cloud):
+        self.clouds.remove(cloud)
+        cloud.delete()
+
+    def create_pearly_gates(self, position):
+        x, y = position
+        self.clouds.add(Cloud(self, (x, y - 1.5), sensor=False,
+                                 static=True))
+
+    def lost(self):
+        return self.icarus.state == 'falling'
+
+    def won(self):
+        return (self.icarus.state == 'standing' and
+                abs(self.icarus.body.position.y -
+                    self.pearly_gates_position[1]) < 2)
+
+    def step(self):
+        if self.script is not None:
+            keys = self.script(self.ticks)
+            if keys is not None:
+                self.icarus.set_keys(keys)
+        if self.input_queue.events:
+            self.input_queue.apply(self.ticks, self.icarus)
+        if self.recording is not None:
+            self.recording.record(self.ticks, self.icarus.keys)
+        self.ticks += 1
+        self.time += self.dt
+        profiler = self.profiler
+        profiler.start('stream')
+        self.streamer.update(self.icarus.body.position.tuple())
+        profiler.stop('stream')
+        profiler.start('icarus')
+        self.icarus.step(self.dt)
+        profiler.stop('icarus')
+        self.sun.step(self.dt)
+        profiler.start('spawn')
+        self.step_clouds(self.dt)
+        profiler.stop('spawn')
+        profiler.start('clouds')
+        self.cloud_field.step(self.dt, self.icarus.body.position.tuple())
+        profiler.stop('clouds')
+        profiler.start('world')
+        active = 0
+        for actor in self.dynamic_actors:
+            body = actor.body
+            if not body.IsSleeping() and not body.IsFrozen():
+                active += 1
+        self.active_body_count = active
+        self.simulated_bodies += active
+        if active:
+            self.world.Step(self.dt, config.position_iterations,
+                            config.velocity_iterations)
+        else:
+            self.skipped_steps += 1
+        profiler.stop('world')
+
+    def run(self, ticks, script=None):
+        # The script maps a tick number to the set of controls held from
+        # that tick on, or None to leave them as they are.
+        if script is not None:
+            self.script = script
+        for _ in range(ticks):
+            self.step()
+
+    def step_clouds(self, dt):
+        self.delete_clouds()
+        self.create_clouds()
+
+    def delete_clouds(self):
+        for cloud in self.clouds.update(self.ticks):
+            self.clouds.remove(cloud)
+            self.cloud_pool.release(cloud)
+
+    def create_clouds(self, init=False):
+        level = self.level
+        while self.clouds.drifting_count < self.cloud_count:
+            side = self.random.choice([-1, 1])
+            if init:
+                x = self.random.uniform(-level.cloud_max_x, level.cloud_max_x)
+            else:
+                x = level.cloud_max_x * side
+            y = self.random.uniform(level.cloud_min_y, level.cloud_max_y)
+            dx = -side * self.random.uniform(level.cloud_min_dx,
+                                             level.cloud_max_dx)
+            cloud = self.cloud_pool.acquire((x, y), (dx, 0))
+            self.clouds.add(cloud)
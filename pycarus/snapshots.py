@@ -0,0 +1,50 @@
+from __future__ import division
+
+from profiler import LatencyMeter, timer
+
+from collections import deque
+import pickle
+
+class SnapshotRing(object):
+    # The last few snapshots of a simulation, with how long they took to
+    # take and to restore.
+    def __init__(self, capacity):
+        self.snapshots = deque(maxlen=capacity)
+        self.capture_times = LatencyMeter(capacity)
+        self.restore_times = LatencyMeter(capacity)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def capture(self, simulation):
+        start = timer()
+        snapshot = simulation.snapshot()
+        self.capture_times.add(timer() - start)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def latest(self, tick, safe=False):
+        # The newest snapshot taken at or before the tick, and if safe is
+        # true, before Icarus was lost. Newer snapshots are dropped, so
+        # going back again goes further back.
+        snapshots = self.snapshots
+        while snapshots and (snapshots[-1]['ticks'] > tick or
+                             safe and snapshots[-1]['lost']):
+            snapshots.pop()
+        return snapshots[-1] if snapshots else None
+
+    def restore(self, simulation, snapshot):
+        start = timer()
+        simulation.restore(snapshot)
+        self.restore_times.add(timer() - start)
+
+    def report(self):
+        size = snapshot_size(self.snapshots[-1]) if self.snapshots else 0
+        return ('snapshots: %d, %.1f KiB, capture %.0f us, restore %.0f us' %
+                (len(self.snapshots), size / 1024,
+                 self.capture_times.percentile(50) * 1e6,
+                 self.restore_times.percentile(50) * 1e6))
+
+def snapshot_size(snapshot):
+    # The size of the snapshot when pickled.
+    return len(pickle.dumps(snapshot, 2))
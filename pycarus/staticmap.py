@@ -0,0 +1,392 @@
+from __future__ import division
+
+from cloudindex import segment_box_fraction
+
+import hashlib
+from math import *
+import numpy
+import os
+import struct
+
+# Slack for rounding in the shade tests, so that a segment that only grazes
+# a box still lists it.
+epsilon = 1e-9
+
+# The compiled form: a header, then the boxes as little-endian doubles and
+# the tile keys, list starts, shade lists and ground flags as integers.
+magic = b'PCSM'
+version = 1
+header_format = struct.Struct('<4sIId4i2dd4I')
+
+class StaticMap(object):
+    # Grid over the level bounds, built once per level and kept in the
+    # level cache. Each cell lists the static boxes that a segment from a
+    # point in the cell to the sun could cross, and tells whether any static
+    # shape is close enough below the cell to stand on. The shade part is
+    # only valid while the sun stays where it was when the map was built.
+    #
+    # A cell only lists the boxes near enough to shade some of it. A box
+    # further away than the shade reach can't be the one that shades Icarus,
+    # and leaving it out only turns one distance past the reach into
+    # another, provided the reach is widened by two box half diagonals. That
+    # holds for the drifting clouds too since they are the same size.
+    #
+    # The cells are grouped in square tiles, and only the tiles with
+    # something in them are stored. Everything stays in the arrays read
+    # from the cache except for the few tiles around Icarus, which are
+    # turned into lists for the per-tick lookups when first used.
+    #
+    # Boxes are rows of (center x, center y, half width, half height).
+    def __init__(self, data, tile_capacity=64):
+        fields = header_format.unpack_from(data)
+        if fields[0] != magic or fields[1] != version:
+            raise ValueError('not a compiled pycarus static map')
+        (self.tile_cells, self.cell_size, self.min_i, self.min_j,
+         self.max_i, self.max_j, sun_x, sun_y, self.shade_reach, box_count,
+         ground_box_count, tile_count, pair_count) = fields[2:]
+        self.sun_position = sun_x, sun_y
+        offset = header_format.size
+        arrays = []
+        for dtype, count in (('<f8', 4 * box_count),
+                             ('<f8', 4 * ground_box_count),
+                             ('<i4', 2 * tile_count),
+                             ('<i4', tile_count * self.tile_cells ** 2 + 1),
+                             ('<i4', pair_count),
+                             ('u1', tile_count * self.tile_cells ** 2)):
+            array = numpy.frombuffer(data, dtype=dtype, count=count,
+                                     offset=offset)
+            arrays.append(array)
+            offset += array.nbytes
+        (shade_boxes, ground_boxes, tile_keys, self.shade_starts,
+         self.shade_lists, self.ground) = arrays
+        self.shade_boxes = shade_boxes.reshape(-1, 4)
+        self.ground_boxes = ground_boxes.reshape(-1, 4)
+        self.tile_keys = tile_keys.reshape(-1, 2)
+        self.shade_pair_count = pair_count
+        self.tile_rows = dict(zip(map(tuple, self.tile_keys.tolist()),
+                                  range(tile_count)))
+        self.tile_capacity = tile_capacity
+        self.tiles = {}
+        # Every box, for points outside the grid. Made when first needed.
+        self.all_boxes = None
+
+    @classmethod
+    def load(cls, cache_dir, bounds, tile_size, cell_size, sun_position,
+             shade_boxes, shade_reach, ground_boxes, ground_reach):
+        # Maps are read from the cache directory when it holds one built
+        # from the same inputs, and built into it otherwise.
+        shade_boxes = numpy.array(shade_boxes, dtype='<f8').reshape(-1, 4)
+        ground_boxes = numpy.array(ground_boxes, dtype='<f8').reshape(-1, 4)
+        tile_cells = max(1, int(round(tile_size / cell_size)))
+        cell_size = tile_size / tile_cells
+        (min_x, min_y), (max_x, max_y) = bounds
+        parameters = struct.pack('<I8d', version, min_x, min_y, max_x, max_y,
+                                 tile_size, cell_size, shade_reach,
+                                 ground_reach)
+        key = hashlib.sha1(parameters + struct.pack('<2d', *sun_position) +
+                           shade_boxes.tobytes() +
+                           ground_boxes.tobytes()).hexdigest()
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, key + '.map')
+            if os.path.exists(cache_path):
+                return cls(open(cache_path, 'rb').read())
+        data = compile_static_map(bounds, tile_cells, cell_size,
+                                  sun_position, shade_boxes, shade_reach,
+                                  ground_boxes, ground_reach)
+        if cache_path is not None:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                out = open(cache_path, 'wb')
+                try:
+                    out.write(data)
+                finally:
+                    out.close()
+            except (IOError, OSError):
+                pass
+        return cls(data)
+
+    def tile(self, position):
+        # The tile holding a point as (ground flags, list starts, boxes) for
+        # its cells, and the index of the cell in it. The tile is None for
+        # an empty tile and the index -1 outside the grid.
+        i = int(floor(position[0] / self.cell_size))
+        j = int(floor(position[1] / self.cell_size))
+        if not (self.min_i <= i <= self.max_i and
+                self.min_j <= j <= self.max_j):
+            return None, -1
+        n = self.tile_cells
+        key = i // n, j // n
+        cell = (j - key[1] * n) * n + i - key[0] * n
+        tile = self.tiles.get(key)
+        if tile is None:
+            row = self.tile_rows.get(key)
+            if row is None:
+                return None, cell
+            if len(self.tiles) >= self.tile_capacity:
+                self.tiles.clear()
+            tile = self.tiles[key] = self.create_tile(row)
+        return tile, cell
+
+    def create_tile(self, row):
+        cells = self.tile_cells ** 2
+        starts = self.shade_starts[row * cells:(row + 1) * cells + 1]
+        first = int(starts[0])
+        indices = self.shade_lists[first:int(starts[-1])].tolist()
+        boxes = [(index,) + tuple(self.shade_boxes[index].tolist())
+                 for index in indices]
+        ground = self.ground[row * cells:(row + 1) * cells].tolist()
+        return ground, (starts - first).tolist(), boxes
+
+    def box(self, index):
+        return tuple(self.shade_boxes[index].tolist())
+
+    def has_ground(self, position):
+        tile, cell = self.tile(position)
+        if cell < 0:
+            return True
+        return tile is not None and bool(tile[0][cell])
+
+    def shade_candidates(self, position):
+        # The boxes that could shade a point, as (index, center x, center y,
+        # half width, half height).
+        tile, cell = self.tile(position)
+        if cell < 0:
+            if self.all_boxes is None:
+                self.all_boxes = [(index,) + tuple(box) for index, box in
+                                  enumerate(self.shade_boxes.tolist())]
+            return self.all_boxes
+        if tile is None:
+            return ()
+        _, starts, boxes = tile
+        return boxes[starts[cell]:starts[cell + 1]]
+
+    def raycast(self, position):
+        # The nearest static box on the segment from a point to the sun, as
+        # (fraction, box index), with index None if there is none.
+        x, y = position
+        sun_x, sun_y = self.sun_position
+        dx = sun_x - x
+        dy = sun_y - y
+        hit_fraction = 1
+        hit_index = None
+        for (index, center_x, center_y, half_width,
+             half_height) in self.shade_candidates(position):
+            fraction = segment_box_fraction(x, y, dx, dy, center_x, center_y,
+                                            half_width, half_height)
+            if fraction is not None and fraction < hit_fraction:
+                hit_fraction = fraction
+                hit_index = index
+        return hit_fraction, hit_index
+
+    def heatmap(self, shadow_length):
+        # Cells as (x1, y1, x2, y2, kind) for drawing, where the kind is
+        # 'shade' if the center of the cell is in the static shade,
+        # 'ground' if Icarus could stand in it and 'near' if a static box
+        # could shade some of it.
+        cells = []
+        n = self.tile_cells
+        size = self.cell_size
+        for row, (tile_i, tile_j) in enumerate(self.tile_keys.tolist()):
+            starts = self.shade_starts[row * n * n:(row + 1) * n * n + 1]
+            ground = self.ground[row * n * n:(row + 1) * n * n]
+            for cell in numpy.flatnonzero(ground | (starts[1:] >
+                                                    starts[:-1])).tolist():
+                x1 = (tile_i * n + cell % n) * size
+                y1 = (tile_j * n + cell // n) * size
+                x2 = x1 + size
+                y2 = y1 + size
+                if ground[cell]:
+                    cells.append((x1, y1, x2, y2, 'ground'))
+                    continue
+                center = (x1 + x2) / 2, (y1 + y2) / 2
+                _, index = self.raycast(center)
+                kind = 'near'
+                if index is not None:
+                    box_x, box_y = self.box(index)[:2]
+                    if hypot(box_x - center[0],
+                             box_y - center[1]) <= shadow_length:
+                        kind = 'shade'
+                cells.append((x1, y1, x2, y2, kind))
+        return cells
+
+def angle_range(sun_position, x1, y1, x2, y2):
+    # The range of directions from the sun to a rectangle, measured from
+    # straight down. A rectangle that holds the sun or reaches across the
+    # straight-up direction, where the angles wrap, gets them all.
+    sun_x, sun_y = sun_position
+    if x1 <= sun_x <= x2 and y2 >= sun_y:
+        return -pi, pi
+    angles = [atan2(x - sun_x, sun_y - y) for x in (x1, x2) for y in (y1, y2)]
+    return min(angles), max(angles)
+
+def shadow_cells(grid, cell_size, sun_position, box, box_lower, box_upper,
+                 near):
+    # The range of cells in the bounding rectangle of the box and what lies
+    # behind it as seen from the sun, clipped to the grid. That area is
+    # bounded by the box, the rays from the sun through its corners and the
+    # edges of the grid.
+    min_i, min_j, max_i, max_j = grid
+    if box_lower == -pi and box_upper == pi:
+        return grid
+    sun_x, sun_y = sun_position
+    grid_x1 = min_i * cell_size
+    grid_y1 = min_j * cell_size
+    grid_x2 = (max_i + 1) * cell_size
+    grid_y2 = (max_j + 1) * cell_size
+    points = []
+    for x in (box[0], box[2]):
+        for y in (box[1], box[3]):
+            points.append((x, y))
+            dx = x - sun_x
+            dy = y - sun_y
+            t = float('inf')
+            if dx:
+                t = min(t, ((grid_x2 if dx > 0 else grid_x1) - x) / dx)
+            if dy:
+                t = min(t, ((grid_y2 if dy > 0 else grid_y1) - y) / dy)
+            if t > 0 and t != float('inf'):
+                points.append((x + dx * t, y + dy * t))
+    for x in (grid_x1, grid_x2):
+        for y in (grid_y1, grid_y2):
+            angle = atan2(x - sun_x, sun_y - y)
+            if (box_lower <= angle <= box_upper and
+                hypot(x - sun_x, y - sun_y) >= near):
+                points.append((x, y))
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return (max(min_i, int(floor(min(xs) / cell_size))),
+            max(min_j, int(floor(min(ys) / cell_size))),
+            min(max_i, int(floor(max(xs) / cell_size))),
+            min(max_j, int(floor(max(ys) / cell_size))))
+
+def shade_pairs(grid, cell_size, sun_position, shade_boxes, reach):
+    # A segment from a point to the sun can only cross a box if the point
+    # lies in the box's direction from the sun and no nearer to the sun
+    # than the box. Test the cells against that, which may list a box that
+    # no segment from the cell hits but never leaves one out. Only the cells
+    # in the bounding rectangle of each box's shadow, within the shade reach
+    # of the box, need testing. Returns the cells as column and row arrays
+    # and the boxes they list.
+    sun_x, sun_y = sun_position
+    size = cell_size
+    columns = []
+    rows = []
+    boxes = []
+    for index, (x, y, half_width, half_height) in enumerate(
+        shade_boxes.tolist()):
+        box = (x - half_width, y - half_height,
+               x + half_width, y + half_height)
+        box_lower, box_upper = angle_range(sun_position, *box)
+        near = hypot(max(box[0] - sun_x, 0, sun_x - box[2]),
+                     max(box[1] - sun_y, 0, sun_y - box[3]))
+        min_i, min_j, max_i, max_j = shadow_cells(
+            grid, size, sun_position, box, box_lower, box_upper, near)
+        min_i = max(min_i, int(floor((x - reach) / size)))
+        min_j = max(min_j, int(floor((y - reach) / size)))
+        max_i = min(max_i, int(floor((x + reach) / size)))
+        max_j = min(max_j, int(floor((y + reach) / size)))
+        if min_i > max_i or min_j > max_j:
+            continue
+        i, j = numpy.meshgrid(numpy.arange(min_i, max_i + 1),
+                              numpy.arange(min_j, max_j + 1))
+        x1 = i * size
+        y1 = j * size
+        x2 = x1 + size
+        y2 = y1 + size
+        corner_angles = [numpy.arctan2(corner_x - sun_x, sun_y - corner_y)
+                         for corner_x in (x1, x2) for corner_y in (y1, y2)]
+        lower = numpy.minimum.reduce(corner_angles)
+        upper = numpy.maximum.reduce(corner_angles)
+        wraps = (x1 <= sun_x) & (sun_x <= x2) & (y2 >= sun_y)
+        lower[wraps] = -pi
+        upper[wraps] = pi
+        far = numpy.hypot(numpy.maximum(abs(x1 - sun_x), abs(x2 - sun_x)),
+                          numpy.maximum(abs(y1 - sun_y), abs(y2 - sun_y)))
+        distance = numpy.hypot(
+            numpy.maximum(numpy.maximum(x1 - x, x - x2), 0),
+            numpy.maximum(numpy.maximum(y1 - y, y - y2), 0))
+        mask = ((lower <= box_upper + epsilon) &
+                (upper >= box_lower - epsilon) &
+                (far >= near - epsilon) &
+                (distance <= reach + epsilon))
+        columns.append(i[mask])
+        rows.append(j[mask])
+        boxes.append(numpy.repeat(index, mask.sum()))
+    if not boxes:
+        return (numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int),
+                numpy.zeros(0, dtype=int))
+    return (numpy.concatenate(columns), numpy.concatenate(rows),
+            numpy.concatenate(boxes))
+
+def ground_cells(grid, cell_size, ground_boxes, ground_reach):
+    # A cell has ground if a downward segment of the ground reach from some
+    # point in it could touch a static box. Returns the cells as column and
+    # row arrays.
+    min_i, min_j, max_i, max_j = grid
+    size = cell_size
+    columns = []
+    rows = []
+    for x, y, half_width, half_height in ground_boxes.tolist():
+        i, j = numpy.meshgrid(
+            numpy.arange(max(min_i, int(floor((x - half_width) / size))),
+                         min(max_i, int(floor((x + half_width) / size))) + 1),
+            numpy.arange(max(min_j, int(floor((y - half_height) / size))),
+                         min(max_j, int(floor((y + half_height +
+                                               ground_reach) / size))) + 1))
+        columns.append(i.ravel())
+        rows.append(j.ravel())
+    if not columns:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    return numpy.concatenate(columns), numpy.concatenate(rows)
+
+def compile_static_map(bounds, tile_cells, cell_size, sun_position,
+                       shade_boxes, shade_reach, ground_boxes, ground_reach):
+    # Builds the map and returns its compiled form. Cells are numbered from
+    # the origin, so that tiles of the chunk size line up with the level's
+    # chunks.
+    (min_x, min_y), (max_x, max_y) = bounds
+    size = cell_size
+    grid = (int(floor(min_x / size)), int(floor(min_y / size)),
+            max(int(floor(min_x / size)), int(ceil(max_x / size)) - 1),
+            max(int(floor(min_y / size)), int(ceil(max_y / size)) - 1))
+    half_diagonal = 0
+    if len(shade_boxes):
+        half_diagonal = numpy.hypot(shade_boxes[:, 2],
+                                    shade_boxes[:, 3]).max()
+    reach = shade_reach + 2 * half_diagonal
+    columns, rows, boxes = shade_pairs(grid, size, sun_position, shade_boxes,
+                                       reach)
+    ground_columns, ground_rows = ground_cells(grid, size, ground_boxes,
+                                               ground_reach)
+
+    # Number the tiles with anything in them, then the cells by tile and by
+    # position in the tile.
+    n = tile_cells
+    keys = numpy.concatenate((
+        numpy.stack((columns // n, rows // n), axis=1),
+        numpy.stack((ground_columns // n, ground_rows // n), axis=1)))
+    tile_keys, tile_numbers = numpy.unique(keys.reshape(-1, 2), axis=0,
+                                           return_inverse=True)
+    tile_numbers = tile_numbers.ravel()
+    cell_count = len(tile_keys) * n * n
+    shade_cells = (tile_numbers[:len(boxes)] * n * n +
+                   rows % n * n + columns % n)
+    ground_flags = numpy.zeros(cell_count, dtype='u1')
+    ground_flags[tile_numbers[len(boxes):] * n * n +
+                 ground_rows % n * n + ground_columns % n] = 1
+
+    # The lists of all cells, stored back to back in cell order.
+    order = numpy.argsort(shade_cells, kind='mergesort')
+    counts = numpy.bincount(shade_cells, minlength=cell_count)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)))
+    header = header_format.pack(
+        magic, version, n, size, grid[0], grid[1], grid[2], grid[3],
+        sun_position[0], sun_position[1], reach, len(shade_boxes),
+        len(ground_boxes), len(tile_keys), len(boxes))
+    return b''.join([
+        header, shade_boxes.astype('<f8').tobytes(),
+        ground_boxes.astype('<f8').tobytes(),
+        tile_keys.astype('<i4').tobytes(), starts.astype('<i4').tobytes(),
+        boxes[order].astype('<i4').tobytes(), ground_flags.tobytes()])
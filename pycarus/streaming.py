@@ -0,0 +1,117 @@
+from __future__ import division
+
+from math import *
+
+class ChunkStreamer(object):
+    # Keeps the bodies of the level chunks near Icarus in the world. Chunks
+    # that come within range are loaded and chunks that fall out of range
+    # (plus one chunk of slack, so that hovering at a border does not
+    # thrash) are unloaded, at most budget bodies per tick, nearest chunks
+    # first. Chunks that Icarus is about to touch are loaded at once.
+    #
+    # The chunks in range are only worked out again once Icarus has moved
+    # the refresh distance, so the range is widened by that much to still
+    # cover the stream distance from wherever he is.
+    refresh_distance = 1
+
+    def __init__(self, simulation, distance, urgent_distance, budget):
+        self.simulation = simulation
+        self.level = simulation.level
+        self.distance = distance
+        self.urgent_distance = urgent_distance
+        self.budget = budget
+        self.loaded = {}
+        self.progress = {}
+        self.focus = None
+        self.busy = False
+        self.created = 0
+        self.destroyed = 0
+
+    def __len__(self):
+        return len(self.loaded)
+
+    def body_count(self):
+        return sum(len(clouds) for clouds in self.loaded.values())
+
+    def update(self, focus, load_all=False):
+        budget = None if load_all else self.budget
+        level = self.level
+        x, y = focus
+        if (self.focus is not None and not self.busy and
+            hypot(x - self.focus[0], y - self.focus[1]) <
+            self.refresh_distance):
+            return
+        self.focus = focus
+        distance = self.distance + self.refresh_distance
+        wanted = level.chunks_in((x - distance, y - distance),
+                                 (x + distance, y + distance))
+        distance += level.chunk_size
+        keep = set(level.chunks_in((x - distance, y - distance),
+                                   (x + distance, y + distance)))
+        for key in wanted:
+            if key not in self.loaded:
+                self.loaded[key] = []
+                self.progress[key] = 0
+        for key in sorted(self.progress,
+                          key=lambda key: level.chunk_distance(key, focus)):
+            if key not in keep:
+                continue
+            if level.chunk_distance(key, focus) <= self.urgent_distance:
+                self.load(key, None)
+            elif budget is None or budget > 0:
+                budget = self.load(key, budget)
+        for key in list(self.loaded):
+            if key not in keep and (budget is None or budget > 0):
+                budget = self.unload(key, budget)
+        # Carry on next tick if the budget ran out.
+        self.busy = bool(self.progress) or any(key not in keep
+                                               for key in self.loaded)
+
+    def snapshot(self):
+        # How many bodies of each chunk are loaded. Chunks load in order, so
+        # that says which.
+        return (self.focus, self.busy,
+                dict((key, len(clouds)) for key, clouds in self.loaded.items()))
+
+    def restore(self, snapshot):
+        self.focus, self.busy, counts = snapshot
+        for key in list(self.loaded):
+            if counts.get(key) != len(self.loaded[key]):
+                self.unload(key, None)
+        for key, count in counts.items():
+            if key not in self.loaded:
+                self.loaded[key] = []
+                self.progress[key] = 0
+                self.load(key, count)
+
+    def load(self, key, budget):
+        items = self.level.chunk_items(key)
+        clouds = self.loaded[key]
+        start = self.progress[key]
+        end = len(items) if budget is None else min(len(items), start + budget)
+        for temple, position in items[start:end]:
+            if temple:
+                clouds.append(self.simulation.create_temple(position))
+            else:
+                clouds.append(self.simulation.create_static_cloud(position))
+        self.created += end - start
+        if end == len(items):
+            del self.progress[key]
+        else:
+            self.progress[key] = end
+        return None if budget is None else budget - (end - start)
+
+    def unload(self, key, budget):
+        clouds = self.loaded[key]
+        count = len(clouds) if budget is None else min(len(clouds), budget)
+        for _ in range(count):
+            self.simulation.delete_static_cloud(clouds.pop())
+        self.destroyed += count
+        if clouds:
+            # What is left is the start of the chunk, so loading it again
+            # picks up from there.
+            self.progress[key] = len(clouds)
+        else:
+            del self.loaded[key]
+            self.progress.pop(key, None)
+        return None if budget is None else budget - count